@@ -3,3 +3,12 @@ from django.apps import AppConfig
 
 class ApiConfig(AppConfig):
     name = 'api'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from foodgram.db_router import install_replica_failure_handler
+
+        from .metrics import install_query_recorder
+        connection_created.connect(install_query_recorder)
+        connection_created.connect(install_replica_failure_handler)
@@ -0,0 +1,55 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from rest_framework.permissions import SAFE_METHODS
+
+
+def async_read_view(view):
+    """ Асинхронная обёртка DRF-view для ASGI.
+
+        Синхронные view Django 3.2 под ASGI выполняет в одном общем
+        потоке, и медленный запрос задерживает все остальные.
+        Безопасные запросы обёртка выполняет в пуле потоков цикла
+        событий: у каждого потока своё соединение с базой, поэтому
+        оно закрывается по CONN_MAX_AGE здесь же, а не сигналами
+        запроса, которые приходят в общий поток. Изменяющие запросы
+        идут в общий поток, как и без обёртки. """
+
+    def run(request, *args, **kwargs):
+        close_old_connections()
+        try:
+            response = view(request, *args, **kwargs)
+            if hasattr(response, 'render'):
+                response.render()
+            return response
+        finally:
+            close_old_connections()
+
+    @wraps(view)
+    async def async_view(request, *args, **kwargs):
+        if request.method in SAFE_METHODS:
+            return await sync_to_async(run, thread_sensitive=False)(
+                request, *args, **kwargs
+            )
+        return await sync_to_async(view, thread_sensitive=True)(
+            request, *args, **kwargs
+        )
+
+    return async_view
+
+
+class AsyncReadMixin:
+    """ Отдавать действия из async_read_actions асинхронными view,
+        если включён ASYNC_READ_VIEWS. Под WSGI обёртка только
+        добавила бы цикл событий и чужие потоки на каждый запрос. """
+    async_read_actions = ('list', 'retrieve')
+
+    @classmethod
+    def as_view(cls, actions=None, **initkwargs):
+        view = super().as_view(actions, **initkwargs)
+        if (settings.ASYNC_READ_VIEWS
+                and actions.get('get') in cls.async_read_actions):
+            return async_read_view(view)
+        return view
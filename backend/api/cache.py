@@ -0,0 +1,111 @@
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from foodgram.db_router import primary_reads
+from recipes.models import Favorite, ShoppingCart
+from recipes.versions import get_recipe_fragment_key, get_version
+from users.models import Follow
+
+
+def get_response_cache_key(request, name, params=()):
+    """ Ключ ответа: версия данных, хост, путь и только те параметры
+        запроса, от которых зависит ответ, в отсортированном виде:
+        ни их порядок, ни посторонние параметры не плодят записи. """
+    query = '&'.join(
+        f'{key}={",".join(sorted(request.query_params.getlist(key)))}'
+        for key in sorted({*params, api_settings.URL_FORMAT_OVERRIDE})
+        if key in request.query_params
+    )
+    variant = '|'.join((
+        request.get_host(), request.path, query,
+        request.META.get('HTTP_ACCEPT', ''),
+    ))
+    return (f'response:{name}:{get_version(name)}:'
+            f'{md5(variant.encode()).hexdigest()}')
+
+
+def cached_anonymous_response(name, handler, request, *args, params=(),
+                              **kwargs):
+    """ Ответ анонимному пользователю из кеша, остальным — как есть.
+        params — параметры запроса, которые входят в ключ. """
+    if not request.user.is_anonymous:
+        return handler(request, *args, **kwargs)
+    key = get_response_cache_key(request, name, params)
+    data = cache.get(key)
+    if data is not None:
+        return Response(data)
+    with primary_reads():
+        response = handler(request, *args, **kwargs)
+    if response.status_code == 200:
+        cache.set(key, response.data, settings.RESPONSE_CACHE_TIMEOUT)
+    return response
+
+
+def get_recipe_fragments(ids, build):
+    """ Общие для всех пользователей представления рецептов одним
+        get_many; недостающие строит build и кладёт одним set_many. """
+    version = get_version('recipe_fragments')
+    keys = {pk: get_recipe_fragment_key(pk, version) for pk in ids}
+    cached = cache.get_many(keys.values())
+    fragments = {pk: cached[key] for pk, key in keys.items() if key in cached}
+    missing = [pk for pk in ids if pk not in fragments]
+    if missing:
+        with primary_reads():
+            built = {fragment['id']: fragment for fragment in build(missing)}
+        cache.set_many(
+            {keys[pk]: fragment for pk, fragment in built.items()},
+            settings.RESPONSE_CACHE_TIMEOUT
+        )
+        fragments.update(built)
+    return [fragments[pk] for pk in ids if pk in fragments]
+
+
+def get_user_flags(user, ids, authors):
+    """ Избранное, корзина и подписки пользователя среди рецептов
+        страницы: по одному запросу на каждый флаг. """
+    favorited = set(Favorite.objects.filter(
+        user=user, recipe_id__in=ids
+    ).values_list('recipe_id', flat=True))
+    in_shopping_cart = set(ShoppingCart.objects.filter(
+        user=user, recipe_id__in=ids
+    ).values_list('recipe_id', flat=True))
+    subscribed = set(Follow.objects.filter(
+        user=user, author_id__in=authors
+    ).values_list('author_id', flat=True))
+    return favorited, in_shopping_cart, subscribed
+
+
+def overlay_user_data(request, fragments):
+    """ Дополнить представления флагами пользователя (три запроса
+        на страницу) и абсолютными адресами картинок. """
+    user = request.user
+    ids = [fragment['id'] for fragment in fragments]
+    if user.is_anonymous:
+        favorited = in_shopping_cart = subscribed = set()
+    else:
+        favorited, in_shopping_cart, subscribed = get_user_flags(
+            user, ids, {fragment['author']['id'] for fragment in fragments}
+        )
+    return [{
+        **fragment,
+        'author': {
+            **fragment['author'],
+            'is_subscribed': fragment['author']['id'] in subscribed,
+        },
+        'is_favorited': fragment['id'] in favorited,
+        'is_in_shopping_cart': fragment['id'] in in_shopping_cart,
+        'image': fragment['image'] and request.build_absolute_uri(
+            fragment['image']
+        ),
+        'image_variants': {
+            variant: {
+                extension: request.build_absolute_uri(url)
+                for extension, url in formats.items()
+            }
+            for variant, formats in fragment['image_variants'].items()
+        },
+    } for fragment in fragments]
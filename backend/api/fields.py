@@ -0,0 +1,25 @@
+from hashlib import sha256
+
+from django.core.files.storage import default_storage
+from drf_extra_fields.fields import Base64ImageField
+
+
+class HashedBase64ImageField(Base64ImageField):
+    """ Картинка в base64, сохраняемая под именем из хеша содержимого.
+        Повторная загрузка того же файла не пишет его заново. """
+
+    def __init__(self, *args, upload_to='', **kwargs):
+        self.upload_to = upload_to
+        super().__init__(*args, **kwargs)
+
+    def get_file_name(self, decoded_file):
+        return sha256(decoded_file).hexdigest()
+
+    def to_internal_value(self, base64_data):
+        image = super().to_internal_value(base64_data)
+        if image is None:
+            return image
+        name = f'{self.upload_to}{image.name}'
+        if default_storage.exists(name):
+            return name
+        return image
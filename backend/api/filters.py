@@ -2,6 +2,8 @@ from django_filters.rest_framework import FilterSet, filters
 from rest_framework.filters import SearchFilter
 
 from recipes.models import Ingredient, Recipe, Tag
+from recipes.search import (filter_recipe_ids, ingredient_index,
+                            recipe_ingredient_index, search_recipes)
 
 
 class IngredientFilter(SearchFilter):
@@ -11,8 +13,20 @@ class IngredientFilter(SearchFilter):
         model = Ingredient
         fields = ('name',)
 
+    def filter_queryset(self, request, queryset, view):
+        name = request.query_params.get(self.search_param, '').strip()
+        if not name or getattr(view, 'action', None) != 'list':
+            return super().filter_queryset(request, queryset, view)
+        return ingredient_index.search(name)
+
+
+class NumberInFilter(filters.BaseInFilter, filters.NumberFilter):
+    pass
+
 
 class RecipeFilter(FilterSet):
+    """ Фильтр рецептов. Параметры ингредиентов отвечаются из
+        инвертированного индекса, а не соединениями с IngredientRecipe. """
     tags = filters.ModelMultipleChoiceFilter(
         field_name='tags__slug',
         to_field_name='slug',
@@ -22,10 +36,40 @@ class RecipeFilter(FilterSet):
     is_in_shopping_cart = filters.NumberFilter(
         method='filter_is_in_shopping_cart'
     )
+    search = filters.CharFilter(method='filter_search')
+    ingredients = NumberInFilter(method='filter_ingredients')
+    exclude_ingredients = NumberInFilter(method='filter_ingredients')
+    ingredients_match = filters.ChoiceFilter(
+        choices=(('all', 'Все'), ('any', 'Хотя бы один')),
+        method='filter_ingredients',
+    )
+    max_missing = filters.NumberFilter(
+        method='filter_ingredients', min_value=0, max_value=10
+    )
 
     class Meta:
         model = Recipe
-        fields = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart',)
+        fields = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart',
+                  'search', 'ingredients', 'exclude_ingredients',
+                  'ingredients_match', 'max_missing',)
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        data = self.form.cleaned_data
+        max_missing = data.get('max_missing')
+        ids, exclude = recipe_ingredient_index.match(
+            include=[int(pk) for pk in data.get('ingredients') or ()],
+            exclude=[int(pk) for pk in data.get('exclude_ingredients') or ()],
+            any_match=data.get('ingredients_match') == 'any',
+            max_missing=None if max_missing is None else int(max_missing),
+        )
+        if ids is None:
+            return queryset
+        return filter_recipe_ids(queryset, ids, exclude)
+
+    def filter_ingredients(self, queryset, name, value):
+        # Все параметры ингредиентов применяются вместе в filter_queryset.
+        return queryset
 
     def filter_is_favorited(self, queryset, name, value):
         if value and self.request.user.is_authenticated:
@@ -36,3 +80,6 @@ class RecipeFilter(FilterSet):
         if value and self.request.user.is_authenticated:
             return queryset.filter(shopping_list__user=self.request.user)
         return
+
+    def filter_search(self, queryset, name, value):
+        return search_recipes(queryset, value)
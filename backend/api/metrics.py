@@ -0,0 +1,175 @@
+import atexit
+import re
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+
+ENDPOINTS_KEY = 'metrics:endpoints'
+ENDPOINT_REGISTERED_KEY = 'metrics:{}:registered'
+METRIC_KEY = 'metrics:{}:{}'
+METRIC_FIELDS = (
+    'requests', 'total_us', 'db_us', 'python_us', 'serializer_us',
+    'queries', 'n_plus_one',
+)
+SQL_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+SQL_PLACEHOLDER_LISTS = re.compile(r'\((?:%s|\?)(?:,\s*(?:%s|\?))*\)')
+
+request_metrics = ContextVar('request_metrics', default=None)
+
+
+def get_sql_shape(sql):
+    """ Форма запроса: без литералов и с одним плейсхолдером
+        вместо списка в IN, чтобы N+1 сводился к одной форме. """
+    sql = SQL_LITERALS.sub('?', sql)
+    return SQL_PLACEHOLDER_LISTS.sub('(...)', sql)
+
+
+class RequestMetrics:
+    """ Счётчики одного запроса: обёртка execute_wrapper для базы
+        и время сериализации от SerializerTimingMixin. """
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.serializing = False
+        self.shapes = Counter()
+        self.databases = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+            self.shapes[get_sql_shape(sql)] += 1
+            self.databases[context['connection'].alias] += 1
+
+    def repeated_shapes(self, threshold):
+        return {
+            shape: count for shape, count in self.shapes.items()
+            if count >= threshold
+        }
+
+
+def record_query(execute, sql, params, many, context):
+    """ Учесть SQL-запрос в метриках текущего запроса. Метрики берутся
+        из контекста, поэтому учитываются и запросы из пула потоков
+        асинхронных view. """
+    metrics = request_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics(execute, sql, params, many, context)
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """ Обработчик connection_created: подключить record_query. """
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class SerializerTimingMixin:
+    """ Учитывать время сериализации в метриках запроса.
+        Вложенные сериализаторы входят во время внешнего. """
+
+    def to_representation(self, instance):
+        metrics = request_metrics.get()
+        if metrics is None or metrics.serializing:
+            return super().to_representation(instance)
+        metrics.serializing = True
+        start = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            metrics.serializing = False
+            metrics.serializer_time += time.perf_counter() - start
+
+
+class EndpointStats:
+    """ Сводка по эндпоинтам в общем кеше. Значения копятся в процессе
+        и сбрасываются в кеш не чаще раза в METRICS_FLUSH_INTERVAL
+        секунд прибавлением к счётчикам, поэтому сводка общая для всех
+        воркеров. Эндпоинт регистрируется один раз: под номером
+        из счётчика ENDPOINTS_KEY, его занимает тот, чей add прошёл. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._flushed = time.monotonic()
+
+    def record(self, endpoint, values):
+        with self._lock:
+            self._pending.setdefault(endpoint, Counter()).update(values)
+            due = (time.monotonic() - self._flushed
+                   >= settings.METRICS_FLUSH_INTERVAL)
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._flushed = time.monotonic()
+        for endpoint, values in pending.items():
+            self.register(endpoint)
+            for field in METRIC_FIELDS:
+                if values[field]:
+                    self.add(METRIC_KEY.format(endpoint, field), values[field])
+
+    @staticmethod
+    def add(key, delta):
+        if not cache.add(key, delta, None):
+            try:
+                cache.incr(key, delta)
+            except ValueError:
+                cache.add(key, delta, None)
+
+    @staticmethod
+    def register(endpoint):
+        if cache.add(ENDPOINT_REGISTERED_KEY.format(endpoint), True, None):
+            cache.add(ENDPOINTS_KEY, 0, None)
+            number = cache.incr(ENDPOINTS_KEY)
+            cache.set(f'{ENDPOINTS_KEY}:{number}', endpoint, None)
+
+    @staticmethod
+    def get_endpoint_keys():
+        return [
+            f'{ENDPOINTS_KEY}:{number}'
+            for number in range(1, cache.get(ENDPOINTS_KEY, 0) + 1)
+        ]
+
+    def get_endpoints(self):
+        return list(cache.get_many(self.get_endpoint_keys()).values())
+
+    def get(self):
+        """ Имя эндпоинта и словарь накопленных значений. """
+        endpoints = self.get_endpoints()
+        stored = cache.get_many([
+            METRIC_KEY.format(endpoint, field)
+            for endpoint in endpoints for field in METRIC_FIELDS
+        ])
+        return {
+            endpoint: {
+                field: stored.get(METRIC_KEY.format(endpoint, field), 0)
+                for field in METRIC_FIELDS
+            }
+            for endpoint in endpoints
+        }
+
+    def reset(self):
+        endpoints = self.get_endpoints()
+        cache.delete_many(
+            [ENDPOINTS_KEY] + self.get_endpoint_keys()
+            + [ENDPOINT_REGISTERED_KEY.format(endpoint)
+               for endpoint in endpoints]
+            + [METRIC_KEY.format(endpoint, field)
+               for endpoint in endpoints for field in METRIC_FIELDS]
+        )
+
+
+endpoint_stats = EndpointStats()
+atexit.register(endpoint_stats.flush)
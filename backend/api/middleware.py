@@ -0,0 +1,139 @@
+import asyncio
+import json
+import logging
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.decorators import sync_and_async_middleware
+from rest_framework.permissions import SAFE_METHODS
+
+from foodgram.db_router import RoutingState, routing_state
+
+from .metrics import RequestMetrics, endpoint_stats, request_metrics
+
+logger = logging.getLogger('api.requests')
+
+PRIMARY_PIN_COOKIE = 'db_primary'
+
+
+def report(request, response, metrics, total):
+    """ Заголовок Server-Timing, строка лога и сводка по эндпоинту. """
+    repeated = metrics.repeated_shapes(settings.N_PLUS_ONE_THRESHOLD)
+    response['Server-Timing'] = ', '.join((
+        f'db;dur={metrics.db_time * 1000:.1f};'
+        f'desc="{metrics.queries} queries"',
+        f'app;dur={(total - metrics.db_time) * 1000:.1f}',
+        f'ser;dur={metrics.serializer_time * 1000:.1f}',
+        f'total;dur={total * 1000:.1f}',
+    ))
+    match = request.resolver_match
+    endpoint = (f'{request.method}:'
+                f'{match.view_name if match else "unresolved"}')
+    values = {
+        'requests': 1,
+        'total_us': int(total * 1e6),
+        'db_us': int(metrics.db_time * 1e6),
+        'python_us': int((total - metrics.db_time) * 1e6),
+        'serializer_us': int(metrics.serializer_time * 1e6),
+        'queries': metrics.queries,
+        'n_plus_one': int(bool(repeated)),
+    }
+    logger.info(json.dumps({
+        'endpoint': endpoint,
+        'path': request.get_full_path(),
+        'status': response.status_code,
+        **values,
+        'databases': metrics.databases,
+    }, ensure_ascii=False))
+    if repeated:
+        logger.warning(json.dumps({
+            'endpoint': endpoint,
+            'path': request.get_full_path(),
+            'repeated_queries': repeated,
+        }, ensure_ascii=False))
+    endpoint_stats.record(endpoint, values)
+
+
+@sync_and_async_middleware
+def request_metrics_middleware(get_response):
+    """ Число и время SQL-запросов, время Python и сериализации:
+        заголовок Server-Timing, строка лога в JSON и сводка
+        по эндпоинтам. Повторы одной формы SQL отмечаются как N+1.
+        Запросы потоковых ответов после возврата из view не учитываются.
+        Под ASGI не переводит цепочку middleware в синхронный режим. """
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            metrics = RequestMetrics()
+            token = request_metrics.set(metrics)
+            start = time.perf_counter()
+            try:
+                response = await get_response(request)
+            finally:
+                request_metrics.reset(token)
+            await sync_to_async(report, thread_sensitive=False)(
+                request, response, metrics, time.perf_counter() - start
+            )
+            return response
+    else:
+        def middleware(request):
+            metrics = RequestMetrics()
+            token = request_metrics.set(metrics)
+            start = time.perf_counter()
+            try:
+                response = get_response(request)
+            finally:
+                request_metrics.reset(token)
+            report(request, response, metrics, time.perf_counter() - start)
+            return response
+
+    return middleware
+
+
+def start_routing(request):
+    return routing_state.set(RoutingState(replicas_allowed=(
+        request.method in SAFE_METHODS
+        and PRIMARY_PIN_COOKIE not in request.COOKIES
+    )))
+
+
+def finish_routing(token, response):
+    """ После записи закрепить клиента за основной базой. """
+    wrote = routing_state.get().wrote
+    routing_state.reset(token)
+    if wrote and response is not None:
+        response.set_cookie(
+            PRIMARY_PIN_COOKIE, '1',
+            max_age=settings.REPLICA_PIN_SECONDS,
+            httponly=True, samesite='Lax',
+        )
+
+
+@sync_and_async_middleware
+def replica_routing_middleware(get_response):
+    """ Разрешить ReplicaRouter читать с реплик в безопасных запросах.
+        После записи клиент получает cookie и ещё REPLICA_PIN_SECONDS
+        читает с основной базы, чтобы видеть свои изменения. """
+    if not settings.DATABASE_REPLICAS:
+        raise MiddlewareNotUsed
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            token, response = start_routing(request), None
+            try:
+                response = await get_response(request)
+            finally:
+                finish_routing(token, response)
+            return response
+    else:
+        def middleware(request):
+            token, response = start_routing(request), None
+            try:
+                response = get_response(request)
+            finally:
+                finish_routing(token, response)
+            return response
+
+    return middleware
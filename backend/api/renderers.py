@@ -0,0 +1,109 @@
+import csv
+from io import BytesIO
+
+from django.conf import settings
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+from rest_framework.renderers import BaseRenderer
+
+SHOPPING_LIST_TITLE = 'Купить в магазине:'
+
+
+class Echo:
+    """ Буфер для csv.writer, возвращающий записанную строку. """
+
+    def write(self, value):
+        return value
+
+
+class ShoppingListRenderer(BaseRenderer):
+    """ Базовый рендерер списка покупок.
+        Сам список отдаётся потоком через stream(), render()
+        используется только для ответов с ошибками. """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict) and 'detail' in data:
+            data = data['detail']
+        return str(data).encode()
+
+    @staticmethod
+    def get_line(ingredient):
+        return (f"{ingredient['ingredient__name']} "
+                f"({ingredient['ingredient__measurement_unit']}) - "
+                f"{ingredient['amount']}")
+
+    def stream(self, ingredients):
+        raise NotImplementedError
+
+
+class ShoppingListTextRenderer(ShoppingListRenderer):
+    """ Список покупок в текстовом файле. """
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, ingredients):
+        yield SHOPPING_LIST_TITLE
+        for ingredient in ingredients:
+            yield f'\n{self.get_line(ingredient)}'
+
+
+class ShoppingListCSVRenderer(ShoppingListRenderer):
+    """ Список покупок в CSV. """
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, ingredients):
+        writer = csv.writer(Echo())
+        yield '\ufeff' + writer.writerow(
+            ('Ингредиент', 'Единица измерения', 'Количество')
+        )
+        for ingredient in ingredients:
+            yield writer.writerow((
+                ingredient['ingredient__name'],
+                ingredient['ingredient__measurement_unit'],
+                ingredient['amount'],
+            ))
+
+
+class ShoppingListPDFRenderer(ShoppingListRenderer):
+    """ Список покупок в PDF.
+        Строк не больше, чем ингредиентов в справочнике,
+        поэтому документ собирается в памяти и отдаётся частями. """
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+    font_name = 'ShoppingListFont'
+    font_size = 12
+    margin = 50
+    chunk_size = 64 * 1024
+
+    def register_font(self):
+        if self.font_name not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(
+                TTFont(self.font_name, settings.SHOPPING_LIST_FONT)
+            )
+
+    def stream(self, ingredients):
+        self.register_font()
+        buffer = BytesIO()
+        document = canvas.Canvas(buffer, pagesize=A4)
+        width, height = A4
+        line_height = self.font_size * 1.5
+        document.setFont(self.font_name, self.font_size)
+        position = height - self.margin
+        document.drawString(self.margin, position, SHOPPING_LIST_TITLE)
+        for ingredient in ingredients:
+            position -= line_height
+            if position < self.margin:
+                document.showPage()
+                document.setFont(self.font_name, self.font_size)
+                position = height - self.margin
+            document.drawString(
+                self.margin, position, self.get_line(ingredient)
+            )
+        document.save()
+        buffer.seek(0)
+        yield from iter(lambda: buffer.read(self.chunk_size), b'')
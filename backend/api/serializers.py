@@ -1,16 +1,27 @@
-from django.shortcuts import get_object_or_404
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from drf_extra_fields.fields import Base64ImageField
-from rest_framework import serializers, status
+from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 from rest_framework.fields import SerializerMethodField
+from rest_framework.settings import api_settings
 
+from recipes import feed
+from recipes.images import schedule_variants
 from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
-                            ShoppingCart, Tag)
+                            ShoppingCart, ShoppingListItem, Tag)
+from recipes.search import publish_recipe_ingredients
+from recipes.signals import change_counter
+from recipes.versions import bump_version_on_commit
 from users.models import User
 
+from .fields import HashedBase64ImageField
+from .metrics import SerializerTimingMixin
 
-class UserSerializer(UserSerializer):
+
+class UserSerializer(SerializerTimingMixin, UserSerializer):
     """ Сериализатор пользователя """
     is_subscribed = SerializerMethodField(read_only=True)
 
@@ -21,8 +32,10 @@ class UserSerializer(UserSerializer):
 
     def get_is_subscribed(self, obj):
         request = self.context.get('request')
-        if self.context.get('request').user.is_anonymous:
+        if not request or request.user.is_anonymous:
             return False
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         return obj.following.filter(user=request.user).exists()
 
 
@@ -45,37 +58,22 @@ class SubscribeListSerializer(UserSerializer):
         fields = UserSerializer.Meta.fields + ('recipes_count', 'recipes')
         read_only_fields = ('email', 'username', 'first_name', 'last_name')
 
-    def validate(self, data):
-        author_id = self.context.get(
-            'request').parser_context.get('kwargs').get('id')
-        author = get_object_or_404(User, id=author_id)
-        user = self.context.get('request').user
-        if user.follower.filter(author=author_id).exists():
-            raise ValidationError(
-                detail='Подписка уже существует',
-                code=status.HTTP_400_BAD_REQUEST,
-            )
-        if user == author:
-            raise ValidationError(
-                detail='Нельзя подписаться на самого себя',
-                code=status.HTTP_400_BAD_REQUEST,
-            )
-        return data
+    def get_is_subscribed(self, obj):
+        return True
 
     def get_recipes_count(self, obj):
-        return obj.recipes.count()
+        return obj.recipes_count
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        limit = request.GET.get('recipes_limit')
+        limit = self.context.get('recipes_limit')
         recipes = obj.recipes.all()
-        if limit:
-            recipes = recipes[: int(limit)]
+        if limit is not None:
+            recipes = recipes[:limit]
         serializer = RecipeShortSerializer(recipes, many=True, read_only=True)
         return serializer.data
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(SerializerTimingMixin, serializers.ModelSerializer):
     """ Сериализатор просмотра тегов """
 
     class Meta:
@@ -83,7 +81,8 @@ class TagSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'color', 'slug')
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(SerializerTimingMixin,
+                           serializers.ModelSerializer):
     """ Сериализатор просмотра ингридиентов """
 
     class Meta:
@@ -106,7 +105,23 @@ class IngredientRecipeSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount',)
 
 
-class RecipeReadSerializer(serializers.ModelSerializer):
+class ImageVariantsMixin:
+    """ Адреса уменьшенных копий картинки рецепта. """
+
+    def get_image_variants(self, obj):
+        request = self.context.get('request')
+        variants = {}
+        for variant, formats in obj.image_variants.items():
+            for extension, name in formats.items():
+                url = default_storage.url(name)
+                if request:
+                    url = request.build_absolute_uri(url)
+                variants.setdefault(variant, {})[extension] = url
+        return variants
+
+
+class RecipeReadSerializer(SerializerTimingMixin, ImageVariantsMixin,
+                           serializers.ModelSerializer):
     """ Сериализатор просмотра рецепта """
     tags = TagSerializer(read_only=False, many=True)
     author = UserSerializer(read_only=True, many=False)
@@ -116,12 +131,13 @@ class RecipeReadSerializer(serializers.ModelSerializer):
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
     image = Base64ImageField(max_length=None)
+    image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
         fields = ('id', 'tags', 'author', 'ingredients',
                   'is_favorited', 'is_in_shopping_cart',
-                  'name', 'image', 'text', 'cooking_time'
+                  'name', 'image', 'image_variants', 'text', 'cooking_time'
                   )
 
     def get_ingredients(self, obj):
@@ -132,26 +148,43 @@ class RecipeReadSerializer(serializers.ModelSerializer):
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         return obj.favorites.filter(user=request.user).exists()
 
     def get_is_in_shopping_cart(self, obj):
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         return obj.shopping_list.filter(user=request.user).exists()
 
 
+class IngredientAmountSerializer(serializers.ModelSerializer):
+    """ Сериализатор ингредиента при создании рецепта """
+    id = serializers.IntegerField()
+
+    class Meta:
+        model = IngredientRecipe
+        fields = ('id', 'amount',)
+
+
+BULK_BATCH_SIZE = 1000
+
+
 class CreateRecipeSerializer(serializers.ModelSerializer):
     """ Сериализатор для создания рецепта """
-    ingredients = IngredientRecipeSerializer(
+    ingredients = IngredientAmountSerializer(
         many=True,
     )
-    tags = serializers.PrimaryKeyRelatedField(
-        many=True,
-        queryset=Tag.objects.all(),
-        error_messages={'does_not_exist': 'Указанного тега не существует'}
+    tags = serializers.ListField(
+        child=serializers.IntegerField(),
+    )
+    image = HashedBase64ImageField(
+        max_length=None,
+        upload_to=Recipe._meta.get_field('image').upload_to
     )
-    image = Base64ImageField(max_length=None)
     author = UserSerializer(read_only=True)
     cooking_time = serializers.IntegerField()
 
@@ -161,12 +194,20 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
             'id', 'tags', 'author', 'ingredients',
             'name', 'image', 'text', 'cooking_time',)
 
+    def get_lookup(self, model, ids):
+        """ Объекты по id: из справочника, заранее загруженного
+            в контекст, или одним запросом. """
+        lookup = self.context.get('lookups', {}).get(model)
+        if lookup is None:
+            return model.objects.in_bulk(ids)
+        return lookup
+
     def validate_tags(self, tags):
-        for tag in tags:
-            if not Tag.objects.filter(id=tag.id).exists():
-                raise serializers.ValidationError(
-                    'Указанного тега не существует')
-        return tags
+        found = self.get_lookup(Tag, tags)
+        if set(tags) - found.keys():
+            raise serializers.ValidationError(
+                'Указанного тега не существует')
+        return [found[tag_id] for tag_id in dict.fromkeys(tags)]
 
     def validate_cooking_time(self, cooking_time):
         if cooking_time < 1:
@@ -187,7 +228,14 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
             if int(ingredient.get('amount')) < 1:
                 raise serializers.ValidationError(
                     'Количество ингредиента больше 0')
-        return ingredients
+        found = self.get_lookup(Ingredient, ingredients_list)
+        if set(ingredients_list) - found.keys():
+            raise serializers.ValidationError(
+                'Указанного ингредиента не существует')
+        return [
+            {'id': found[ingredient['id']], 'amount': ingredient['amount']}
+            for ingredient in ingredients
+        ]
 
     @staticmethod
     def create_ingredients(recipe, ingredients):
@@ -202,51 +250,181 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
             )
         IngredientRecipe.objects.bulk_create(ingredient_liist)
 
+    @staticmethod
+    def update_tags(recipe, tags):
+        current = set(recipe.tags.values_list('id', flat=True))
+        wanted = {tag.id for tag in tags}
+        if current - wanted:
+            recipe.tags.remove(*(current - wanted))
+        if wanted - current:
+            recipe.tags.add(*(wanted - current))
+
+    @staticmethod
+    def update_ingredients(recipe, ingredients):
+        """ Привести ингредиенты рецепта к переданным, меняя только
+            отличающиеся строки. Возвращает id изменённых ингредиентов. """
+        current = {
+            row.ingredient_id: row for row in recipe.ingredienttorecipe.all()
+        }
+        wanted = {
+            ingredient['id'].id: ingredient['amount']
+            for ingredient in ingredients
+        }
+        removed = current.keys() - wanted.keys()
+        added = wanted.keys() - current.keys()
+        changed = [
+            row for ingredient_id, row in current.items()
+            if ingredient_id in wanted and row.amount != wanted[ingredient_id]
+        ]
+        if removed:
+            IngredientRecipe.objects.filter(
+                recipe=recipe, ingredient_id__in=removed
+            ).delete()
+        for row in changed:
+            row.amount = wanted[row.ingredient_id]
+        if changed:
+            IngredientRecipe.objects.bulk_update(changed, ('amount',))
+        if added:
+            IngredientRecipe.objects.bulk_create(
+                IngredientRecipe(
+                    recipe=recipe,
+                    ingredient_id=ingredient_id,
+                    amount=wanted[ingredient_id],
+                )
+                for ingredient_id in added
+            )
+        return removed | added | {row.ingredient_id for row in changed}
+
+    @transaction.atomic
     def create(self, validated_data):
         request = self.context.get('request', None)
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
         recipe = Recipe.objects.create(author=request.user, **validated_data)
         recipe.tags.set(tags)
+        publish_recipe_ingredients({
+            recipe.id: [ingredient['id'].id for ingredient in ingredients]
+        })
         self.create_ingredients(recipe, ingredients)
+        schedule_variants(recipe.image.name)
         return recipe
 
+    @staticmethod
+    @transaction.atomic
+    def bulk_create(items, author, batch_size=BULK_BATCH_SIZE):
+        """ Создать рецепты пачкой: рецепты, теги и ингредиенты
+            вставляются batched bulk_create. """
+        recipes = [
+            Recipe(author=author, **{
+                field: value for field, value in item.items()
+                if field not in ('tags', 'ingredients')
+            })
+            for item in items
+        ]
+        if connection.features.can_return_rows_from_bulk_insert:
+            Recipe.objects.bulk_create(recipes, batch_size=batch_size)
+            change_counter(User, author.id, 'recipes_count', len(recipes))
+            feed.fan_out(recipes)
+        else:
+            for recipe in recipes:
+                recipe.save()
+        recipe_tag = Recipe.tags.through
+        recipe_tag.objects.bulk_create(
+            (recipe_tag(recipe_id=recipe.id, tag_id=tag.id)
+             for recipe, item in zip(recipes, items)
+             for tag in item['tags']),
+            batch_size=batch_size
+        )
+        IngredientRecipe.objects.bulk_create(
+            (IngredientRecipe(recipe=recipe,
+                              ingredient=ingredient['id'],
+                              amount=ingredient['amount'])
+             for recipe, item in zip(recipes, items)
+             for ingredient in item['ingredients']),
+            batch_size=batch_size
+        )
+        publish_recipe_ingredients({
+            recipe.id: [
+                ingredient['id'].id for ingredient in item['ingredients']
+            ]
+            for recipe, item in zip(recipes, items)
+        })
+        for name in {recipe.image.name for recipe in recipes}:
+            schedule_variants(name)
+        bump_version_on_commit('recipes')
+        return recipes
+
+    @transaction.atomic
     def update(self, instance, validated_data):
-        instance.tags.clear()
-        IngredientRecipe.objects.filter(recipe=instance).delete()
-        instance.tags.set(validated_data.pop('tags'))
-        ingredients = validated_data.pop('ingredients')
-        self.create_ingredients(instance, ingredients)
-        return super().update(instance, validated_data)
+        # Строку рецепта блокируем раньше строк пользователей в refresh():
+        # в этом же порядке их берут добавление и удаление из корзины.
+        list(Recipe.objects.select_for_update().filter(
+            pk=instance.pk
+        ).values_list('pk'))
+        tags = validated_data.pop('tags', None)
+        ingredients = validated_data.pop('ingredients', None)
+        if tags is not None:
+            self.update_tags(instance, tags)
+        if ingredients is not None:
+            publish_recipe_ingredients({
+                instance.id: [
+                    ingredient['id'].id for ingredient in ingredients
+                ]
+            })
+            changed = self.update_ingredients(instance, ingredients)
+            if changed:
+                ShoppingListItem.objects.refresh(
+                    instance.shopping_list.values('user'), changed
+                )
+        image_changed = 'image' in validated_data
+        if image_changed:
+            validated_data['image_variants'] = {}
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
+        instance.save(update_fields=[*validated_data, 'modified'])
+        if image_changed:
+            schedule_variants(instance.image.name)
+        return instance
 
     def to_representation(self, instance):
+        prefetch_related_objects([instance], 'tags', Prefetch(
+            'ingredienttorecipe',
+            queryset=IngredientRecipe.objects.select_related('ingredient')
+        ))
         return RecipeReadSerializer(instance, context={
             'request': self.context.get('request')
         }).data
 
 
-class RecipeShortSerializer(serializers.ModelSerializer):
+class RecipeShortSerializer(SerializerTimingMixin, ImageVariantsMixin,
+                            serializers.ModelSerializer):
     """ Сериализатор полей избранных рецептов и покупок """
+    image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
 
 
-class FavoriteSerializer(serializers.ModelSerializer):
-    """  Сериализатор избранных рецептов """
+def non_field_error(message):
+    return ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [message]})
+
+
+class UserRecipeSerializer(serializers.ModelSerializer):
+    """ Базовый сериализатор избранного и списка покупок.
+        Повтор ловится уникальным ограничением при вставке. """
+    already_exists_message = None
 
     class Meta:
-        model = Favorite
         fields = ('user', 'recipe',)
+        read_only_fields = ('user', 'recipe',)
 
-    def validate(self, data):
-        user = data['user']
-        if user.favorites.filter(recipe=data['recipe']).exists():
-            raise serializers.ValidationError(
-                'Рецепт уже добавлен в избранное.'
-            )
-        return data
+    def create(self, validated_data):
+        try:
+            with transaction.atomic():
+                return super().create(validated_data)
+        except IntegrityError:
+            raise non_field_error(self.already_exists_message)
 
     def to_representation(self, instance):
         return RecipeShortSerializer(
@@ -255,23 +433,25 @@ class FavoriteSerializer(serializers.ModelSerializer):
         ).data
 
 
-class ShoppingCartSerializer(serializers.ModelSerializer):
+class FavoriteSerializer(UserRecipeSerializer):
+    """  Сериализатор избранных рецептов """
+    already_exists_message = 'Рецепт уже добавлен в избранное.'
+
+    class Meta(UserRecipeSerializer.Meta):
+        model = Favorite
+
+
+class ShoppingCartSerializer(UserRecipeSerializer):
     """Сериализатор для списка покупок """
+    already_exists_message = 'Рецепт уже добавлен в корзину'
 
-    class Meta:
+    class Meta(UserRecipeSerializer.Meta):
         model = ShoppingCart
-        fields = ('user', 'recipe',)
 
-    def validate(self, data):
-        user = data['user']
-        if user.shopping_list.filter(recipe=data['recipe']).exists():
-            raise serializers.ValidationError(
-                'Рецепт уже добавлен в корзину'
-            )
-        return data
 
-    def to_representation(self, instance):
-        return RecipeShortSerializer(
-            instance.recipe,
-            context={'request': self.context.get('request')}
-        ).data
+class RecipeIdsSerializer(serializers.Serializer):
+    """ Сериализатор списка рецептов для пакетных операций """
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(),
+        allow_empty=False,
+    )
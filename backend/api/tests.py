@@ -0,0 +1,827 @@
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+from datetime import datetime, timezone
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection, connections
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient, APITestCase, APITransactionTestCase
+
+from api.metrics import endpoint_stats
+from api.serializers import CreateRecipeSerializer
+from foodgram.db_router import replica_health
+from recipes.management.commands.check_query_budgets import IMAGE
+from recipes.models import (Favorite, FeedEntry, Ingredient, IngredientRecipe,
+                            Recipe, ShoppingCart, ShoppingListItem, Tag)
+from users.models import Follow, User
+
+RECIPES_COUNT = 20
+REPLICA = 'replica_test'
+
+
+def create_user(name):
+    return User.objects.create_user(
+        email=f'{name}@foodgram.ru', username=name, password='Pass-12345',
+        first_name=name, last_name=name,
+    )
+
+
+class RecipeListQueriesTests(APITestCase):
+    """ Число SQL-запросов списка рецептов не зависит от размера
+        страницы. """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        authors = [create_user(f'author{number}') for number in range(2)]
+        tags = [
+            Tag.objects.create(
+                name=f'Тег {number}', color=f'#00000{number}',
+                slug=f'tag{number}'
+            )
+            for number in range(3)
+        ]
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {number}', measurement_unit='г'
+            )
+            for number in range(5)
+        ]
+        for number in range(RECIPES_COUNT):
+            recipe = Recipe.objects.create(
+                author=authors[number % len(authors)],
+                name=f'Рецепт {number}', text='Описание', cooking_time=10,
+                image='recipes/image/test.png',
+            )
+            recipe.tags.set(tags)
+            IngredientRecipe.objects.bulk_create(
+                IngredientRecipe(recipe=recipe, ingredient=ingredient,
+                                 amount=number + 1)
+                for ingredient in ingredients
+            )
+            if number % 2:
+                Favorite.objects.create(user=cls.user, recipe=recipe)
+            if number % 3:
+                ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+        Follow.objects.create(user=cls.user, author=authors[0])
+        cls.token = Token.objects.create(user=cls.user)
+
+    def count_queries(self, client, limit):
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = client.get(f'/api/recipes/?limit={limit}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), limit)
+        return len(context)
+
+    def assert_constant_queries(self, client):
+        self.assertEqual(
+            self.count_queries(client, 1),
+            self.count_queries(client, RECIPES_COUNT),
+        )
+
+    def test_anonymous_list(self):
+        self.assert_constant_queries(APIClient())
+
+    def test_authenticated_list(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.assert_constant_queries(client)
+
+
+class RecipesLimitTests(APITestCase):
+    """ Параметр recipes_limit подписок. """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('follower')
+        cls.authors = [create_user(f'chef{number}') for number in range(2)]
+        for author in cls.authors:
+            for number in range(3):
+                Recipe.objects.create(
+                    author=author, name=f'Рецепт {number}', text='Описание',
+                    cooking_time=10, image='recipes/image/test.png',
+                )
+        Follow.objects.create(user=cls.user, author=cls.authors[0])
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def get_recipes_counts(self, recipes_limit):
+        response = self.client.get(
+            f'/api/users/subscriptions/?recipes_limit={recipes_limit}'
+        )
+        self.assertEqual(response.status_code, 200)
+        return [len(author['recipes']) for author in response.data['results']]
+
+    def test_subscriptions(self):
+        self.assertEqual(self.get_recipes_counts(1), [1])
+        self.assertEqual(self.get_recipes_counts('abc'), [3])
+
+    def test_subscribe(self):
+        response = self.client.post(
+            f'/api/users/{self.authors[1].pk}/subscribe/?recipes_limit=abc'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['recipes']), 3)
+
+
+class BatchCountersTests(APITestCase):
+    """ Пакетные изменения избранного меняют счётчики только
+        на действительно добавленные и удалённые рецепты. """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('batcher')
+        cls.recipes = [
+            Recipe.objects.create(
+                author=cls.user, name=f'Рецепт {number}', text='Описание',
+                cooking_time=10, image='recipes/image/test.png',
+            )
+            for number in range(3)
+        ]
+        Favorite.objects.create(user=cls.user, recipe=cls.recipes[0])
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def change(self, method, recipes):
+        response = getattr(self.client, method)(
+            '/api/recipes/favorite/batch/',
+            {'recipes': [recipe.pk for recipe in recipes]}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def get_counts(self):
+        return [
+            Recipe.objects.get(pk=recipe.pk).favorites_count
+            for recipe in self.recipes
+        ]
+
+    def test_add_and_remove(self):
+        data = self.change('post', self.recipes[:2])
+        self.assertEqual(data['added'], [self.recipes[1].pk])
+        self.assertEqual(data['already_present'], [self.recipes[0].pk])
+        self.assertEqual(self.get_counts(), [1, 1, 0])
+        self.change('post', self.recipes[:2])
+        self.assertEqual(self.get_counts(), [1, 1, 0])
+        data = self.change('delete', self.recipes[1:])
+        self.assertEqual(data['removed'], [self.recipes[1].pk])
+        self.assertEqual(data['not_present'], [self.recipes[2].pk])
+        self.assertEqual(self.get_counts(), [1, 0, 0])
+
+
+class RequestStatsTests(APITestCase):
+    """ Сводка по эндпоинтам копится в общем кеше. """
+
+    def setUp(self):
+        endpoint_stats.flush()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        shared_cache = override_settings(
+            CACHES={'default': {
+                'BACKEND':
+                    'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': directory,
+            }},
+            METRICS_FLUSH_INTERVAL=0,
+        )
+        shared_cache.enable()
+        self.addCleanup(shared_cache.disable)
+
+    def test_summary(self):
+        for _ in range(2):
+            self.client.get('/api/tags/')
+        self.client.get('/api/ingredients/')
+        output = StringIO()
+        call_command('request_stats', '--reset', stdout=output)
+        lines = output.getvalue().splitlines()
+        self.assertEqual(sorted(line.split()[:2] for line in lines[1:3]), [
+            ['GET:api:ingredients-list', '1'], ['GET:api:tags-list', '2'],
+        ])
+        output = StringIO()
+        call_command('request_stats', stdout=output)
+        self.assertIn('Сводка пуста', output.getvalue())
+
+    def test_local_cache(self):
+        with override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }}):
+            with self.assertRaises(CommandError):
+                call_command('request_stats')
+
+
+class StaleCountersTests(APITestCase):
+    """ Сохранение объекта, загруженного до изменения счётчиков,
+        не возвращает счётчикам прежние значения. """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('counted')
+        cls.fan = create_user('fan')
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Рецепт', text='Описание',
+            cooking_time=10, image='recipes/image/test.png',
+        )
+
+    def test_recipe_update(self):
+        stale = Recipe.objects.get(pk=self.recipe.pk)
+        Favorite.objects.create(user=self.fan, recipe=self.recipe)
+        serializer = CreateRecipeSerializer(
+            stale, data={'text': 'Новое описание'}, partial=True
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        recipe = Recipe.objects.get(pk=self.recipe.pk)
+        self.assertEqual(recipe.text, 'Новое описание')
+        self.assertEqual(recipe.favorites_count, 1)
+
+    def test_model_save(self):
+        stale_recipe = Recipe.objects.get(pk=self.recipe.pk)
+        stale_author = User.objects.get(pk=self.author.pk)
+        Favorite.objects.create(user=self.fan, recipe=self.recipe)
+        Follow.objects.create(user=self.fan, author=self.author)
+        stale_recipe.name = 'Новое название'
+        stale_recipe.save()
+        stale_author.set_password('New-pass-12345')
+        stale_author.save()
+        recipe = Recipe.objects.get(pk=self.recipe.pk)
+        author = User.objects.get(pk=self.author.pk)
+        self.assertEqual(recipe.name, 'Новое название')
+        self.assertEqual(recipe.favorites_count, 1)
+        self.assertEqual(author.recipes_count, 1)
+        self.assertEqual(author.followers_count, 1)
+        self.assertTrue(author.check_password('New-pass-12345'))
+
+
+class ReplicaRoutingTests(APITransactionTestCase):
+    """ Чтения с реплики на двух базах SQLite: реплика — копия
+        основной базы, открытая только на чтение. """
+
+    def setUp(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Реплика собирается копированием базы SQLite')
+        self.user = create_user('replica_reader')
+        Tag.objects.create(name='Основная', color='#123456', slug='main')
+        self.recipe = Recipe.objects.create(
+            author=self.user, name='Рецепт', text='Описание',
+            cooking_time=10, image='recipes/image/test.png',
+        )
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'replica.sqlite3')
+        connection.ensure_connection()
+        replica = sqlite3.connect(self.path)
+        connection.connection.backup(replica)
+        replica.execute("UPDATE recipes_tag SET name = 'Реплика'")
+        replica.commit()
+        replica.close()
+        connections.settings[REPLICA] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': f'{Path(self.path).as_uri()}?mode=ro',
+        }
+        self.addCleanup(self.remove_replica)
+        routing = override_settings(
+            DATABASE_REPLICAS=[REPLICA], REPLICA_HEALTH_INTERVAL=60
+        )
+        routing.enable()
+        self.addCleanup(routing.disable)
+        replica_health._checked.clear()
+        self.addCleanup(replica_health._checked.clear)
+
+    @staticmethod
+    def remove_replica():
+        connections[REPLICA].close()
+        del connections[REPLICA]
+        del connections.settings[REPLICA]
+
+    def request(self, method, url):
+        """ Ответ и число SQL-запросов по базам из лога запроса. """
+        with self.assertLogs('api.requests', 'INFO') as logs:
+            response = getattr(self.client, method)(url)
+        return response, json.loads(logs.records[0].getMessage())['databases']
+
+    def get_tags(self):
+        response, databases = self.request('get', '/api/tags/')
+        self.assertEqual(response.status_code, 200)
+        return [tag['name'] for tag in response.data], set(databases)
+
+    def test_safe_reads_use_replica(self):
+        self.assertEqual(self.get_tags(), (['Реплика'], {REPLICA}))
+
+    def test_reads_after_write_use_primary(self):
+        response, databases = self.request(
+            'post', f'/api/recipes/{self.recipe.pk}/favorite/'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(set(databases), {'default'})
+        self.assertIn('db_primary', response.cookies)
+        self.assertEqual(self.get_tags(), (['Основная'], {'default'}))
+        del self.client.cookies['db_primary']
+        self.assertEqual(self.get_tags(), (['Реплика'], {REPLICA}))
+
+    def test_missing_replica(self):
+        os.remove(self.path)
+        with self.assertLogs('foodgram.db', 'WARNING'):
+            self.assertEqual(self.get_tags(), (['Основная'], {'default'}))
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_empty_replica(self):
+        open(self.path, 'w').close()
+        with self.assertLogs('foodgram.db', 'WARNING'):
+            self.assertEqual(self.get_tags(), (['Основная'], {'default'}))
+
+    def test_failed_query_retried_on_primary(self):
+        self.assertEqual(self.get_tags(), (['Реплика'], {REPLICA}))
+        replica = sqlite3.connect(self.path)
+        replica.execute('DROP TABLE recipes_tag')
+        replica.close()
+        with self.assertLogs('foodgram.db', 'WARNING'):
+            self.assertEqual(
+                self.get_tags(), (['Основная'], {REPLICA, 'default'})
+            )
+        self.assertEqual(self.get_tags(), (['Основная'], {'default'}))
+
+
+@override_settings(FEED_FANOUT_LIMIT=2, FEED_BACKFILL=100)
+class FeedTests(APITestCase):
+    """ Лента сливает разложенные записи с рецептами авторов,
+        которых читает сама, и не теряет рецепты, когда автор
+        пересекает FEED_FANOUT_LIMIT. """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = create_user('feed_reader')
+        cls.other = create_user('feed_other')
+        cls.pushed = create_user('pushed_author')
+        cls.pulled = create_user('pulled_author')
+        for number in range(8):
+            recipe = Recipe.objects.create(
+                author=(cls.pushed, cls.pulled)[number % 2],
+                name=f'Рецепт {number}', text='Описание', cooking_time=10,
+                image='recipes/image/test.png',
+            )
+            # Попарно одинаковые даты: порядок внутри пары задаёт id.
+            Recipe.objects.filter(pk=recipe.pk).update(pub_date=datetime(
+                2024, 1, 1 + number // 2, tzinfo=timezone.utc
+            ))
+        Follow.objects.create(user=cls.reader, author=cls.pushed)
+        Follow.objects.create(user=cls.other, author=cls.pulled)
+        Follow.objects.create(user=cls.reader, author=cls.pulled)
+
+    def setUp(self):
+        self.client.force_authenticate(self.reader)
+
+    def read_feed(self, limit=3):
+        ids, url = [], f'/api/recipes/feed/?limit={limit}'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [recipe['id'] for recipe in response.data['results']]
+            url = response.data['next']
+        return ids
+
+    def get_expected(self):
+        return list(Recipe.objects.filter(
+            author__in=(self.pushed, self.pulled)
+        ).order_by('-pub_date', '-id').values_list('id', flat=True))
+
+    def test_merge_order(self):
+        self.assertFalse(
+            FeedEntry.objects.filter(recipe__author=self.pulled).exists()
+        )
+        self.assertEqual(self.read_feed(), self.get_expected())
+        self.assertEqual(self.read_feed(limit=1), self.get_expected())
+
+    def test_author_reaches_limit(self):
+        Follow.objects.filter(user=self.reader, author=self.pulled).delete()
+        Follow.objects.create(user=self.reader, author=self.pulled)
+        self.assertFalse(
+            FeedEntry.objects.filter(recipe__author=self.pulled).exists()
+        )
+        self.assertEqual(self.read_feed(), self.get_expected())
+
+    def test_author_drops_below_limit(self):
+        Follow.objects.filter(user=self.other, author=self.pulled).delete()
+        self.assertEqual(FeedEntry.objects.filter(
+            user=self.reader, recipe__author=self.pulled
+        ).count(), 4)
+        self.assertEqual(self.read_feed(), self.get_expected())
+
+
+class KeysetPaginationTests(APITestCase):
+    """ Курсорная пагинация списка рецептов. """
+
+    @classmethod
+    def setUpTestData(cls):
+        author = create_user('keyset_author')
+        for number in range(7):
+            recipe = Recipe.objects.create(
+                author=author, name=f'Рецепт {number}', text='Описание',
+                cooking_time=10, image='recipes/image/test.png',
+            )
+            # Три рецепта с одной датой: между ними порядок задаёт id.
+            Recipe.objects.filter(pk=recipe.pk).update(pub_date=datetime(
+                2024, 1, 1 + max(number - 2, 0), tzinfo=timezone.utc
+            ))
+
+    def read_pages(self, limit):
+        pages, url = [], f'/api/recipes/?pagination=cursor&limit={limit}'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            pages.append([recipe['id'] for recipe in response.data['results']])
+            url = response.data['next']
+        return pages
+
+    def test_round_trip(self):
+        expected = list(Recipe.objects.order_by(
+            '-pub_date', '-id'
+        ).values_list('id', flat=True))
+        for limit in (1, 2, 3, 7):
+            with self.subTest(limit=limit):
+                pages = self.read_pages(limit)
+                self.assertTrue(all(len(page) <= limit for page in pages))
+                self.assertEqual(sum(pages, []), expected)
+
+    def test_ties_broken_by_id(self):
+        ties = sorted(Recipe.objects.filter(
+            pub_date=datetime(2024, 1, 1, tzinfo=timezone.utc)
+        ).values_list('id', flat=True), reverse=True)
+        self.assertEqual(len(ties), 3)
+        self.assertEqual(sum(self.read_pages(2), [])[-3:], ties)
+
+    def test_malformed_cursor(self):
+        for cursor in ('abc', 'bm90LWEtY3Vyc29y', 'MjAyNHwx', '%%%'):
+            with self.subTest(cursor=cursor), self.assertLogs(
+                'django.request', 'WARNING'
+            ):
+                response = self.client.get(
+                    '/api/recipes/', {'cursor': cursor}
+                )
+                self.assertEqual(response.status_code, 404)
+
+
+class RecipeUpdateTests(APITestCase):
+    """ Правка рецепта меняет только отличающиеся теги и строки
+        ингредиентов и пересчитывает списки покупок. """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('editor')
+        cls.buyer = create_user('buyer')
+        cls.tags = [
+            Tag.objects.create(
+                name=f'Правка {number}', color=f'#10000{number}',
+                slug=f'edit{number}'
+            )
+            for number in range(3)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Правка {number}', measurement_unit='г'
+            )
+            for number in range(4)
+        ]
+        cls.recipe, other = [
+            Recipe.objects.create(
+                author=cls.author, name=name, text='Описание',
+                cooking_time=10, image='recipes/image/test.png',
+            )
+            for name in ('Рецепт', 'Другой')
+        ]
+        cls.recipe.tags.set(cls.tags[:2])
+        for ingredient, amount in zip(cls.ingredients, (10, 20, 30)):
+            IngredientRecipe.objects.create(
+                recipe=cls.recipe, ingredient=ingredient, amount=amount
+            )
+        IngredientRecipe.objects.create(
+            recipe=other, ingredient=cls.ingredients[0], amount=5
+        )
+        for recipe in (cls.recipe, other):
+            ShoppingCart.objects.create(user=cls.buyer, recipe=recipe)
+        ShoppingListItem.objects.refresh([cls.buyer.pk])
+
+    def setUp(self):
+        self.client.force_authenticate(self.author)
+
+    def patch(self, tags, ingredients):
+        response = self.client.patch(f'/api/recipes/{self.recipe.pk}/', {
+            'tags': [tag.pk for tag in tags],
+            'ingredients': [
+                {'id': ingredient.pk, 'amount': amount}
+                for ingredient, amount in ingredients
+            ],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def get_rows(self):
+        return {
+            row.ingredient_id: (row.pk, row.amount)
+            for row in self.recipe.ingredienttorecipe.all()
+        }
+
+    def test_diff_update(self):
+        first, second, third, fourth = self.ingredients
+        rows = self.get_rows()
+        tag_rows = dict(Recipe.tags.through.objects.filter(
+            recipe=self.recipe
+        ).values_list('tag', 'pk'))
+        self.patch(self.tags[1:], ((first, 10), (second, 25), (fourth, 40)))
+        updated = self.get_rows()
+        self.assertEqual(updated.keys(), {first.pk, second.pk, fourth.pk})
+        self.assertEqual(updated[first.pk], rows[first.pk])
+        self.assertEqual(updated[second.pk], (rows[second.pk][0], 25))
+        self.assertEqual(updated[fourth.pk][1], 40)
+        self.assertEqual(Recipe.tags.through.objects.get(
+            recipe=self.recipe, tag=self.tags[1]
+        ).pk, tag_rows[self.tags[1].pk])
+        self.assertEqual(
+            set(self.recipe.tags.values_list('pk', flat=True)),
+            {tag.pk for tag in self.tags[1:]},
+        )
+        self.assertEqual(dict(ShoppingListItem.objects.filter(
+            user=self.buyer
+        ).values_list('ingredient', 'total_amount')), {
+            first.pk: 15, second.pk: 25, fourth.pk: 40,
+        })
+
+    def test_unchanged_update(self):
+        rows = self.get_rows()
+        with mock.patch.object(
+            ShoppingListItem.objects, 'refresh'
+        ) as refresh:
+            self.patch(self.tags[:2], zip(self.ingredients, (10, 20, 30)))
+        refresh.assert_not_called()
+        self.assertEqual(self.get_rows(), rows)
+
+
+class RecipeBulkTests(APITestCase):
+    """ Пакетное создание рецептов: ошибки отдельных рецептов не мешают
+        остальным, сбой вставки откатывает весь пакет, а число запросов
+        не растёт с размером пакета. """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('importer')
+        cls.tags = [
+            Tag.objects.create(
+                name=f'Импорт {number}', color=f'#20000{number}',
+                slug=f'import{number}'
+            )
+            for number in range(2)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Импорт {number}', measurement_unit='г'
+            )
+            for number in range(3)
+        ]
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        isolated = override_settings(MEDIA_ROOT=media)
+        isolated.enable()
+        self.addCleanup(isolated.disable)
+        self.client.force_authenticate(self.author)
+
+    def get_item(self, name, ingredient=None):
+        return {
+            'tags': [tag.pk for tag in self.tags],
+            'ingredients': [
+                {'id': ingredient or self.ingredients[0].pk, 'amount': 10},
+                {'id': self.ingredients[1].pk, 'amount': 20},
+            ],
+            'name': name, 'text': 'Импорт', 'cooking_time': 10,
+            'image': IMAGE,
+        }
+
+    def post(self, items, expected):
+        response = self.client.post(
+            '/api/recipes/bulk/', items, format='json'
+        )
+        self.assertEqual(response.status_code, expected)
+        return response.data
+
+    def test_invalid_items_reported(self):
+        data = self.post([
+            self.get_item('Первый'),
+            self.get_item('Без ингредиента', ingredient=10 ** 6),
+            self.get_item('Второй'),
+            {**self.get_item('Без названия'), 'name': ''},
+        ], 201)
+        self.assertEqual([error['index'] for error in data['errors']], [1, 3])
+        self.assertCountEqual(
+            Recipe.objects.values_list('name', flat=True),
+            ['Первый', 'Второй']
+        )
+        self.assertCountEqual(data['created'], Recipe.objects.values_list(
+            'pk', flat=True
+        ))
+        self.assertEqual(IngredientRecipe.objects.count(), 4)
+        self.assertEqual(Recipe.tags.through.objects.count(), 4)
+
+    def test_nothing_valid(self):
+        with self.assertLogs('django.request', 'WARNING'):
+            data = self.post([self.get_item('', ingredient=10 ** 6)], 400)
+        self.assertEqual(data['created'], [])
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_failed_insert_rolls_back(self):
+        with mock.patch.object(
+            IngredientRecipe.objects, 'bulk_create',
+            side_effect=IntegrityError
+        ), self.assertRaises(IntegrityError), self.assertLogs(
+            'django.request', 'ERROR'
+        ):
+            self.client.post('/api/recipes/bulk/', [
+                self.get_item(f'Рецепт {number}') for number in range(3)
+            ], format='json')
+        self.assertFalse(Recipe.objects.exists())
+        self.assertFalse(Recipe.tags.through.objects.exists())
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 0)
+
+    def count_queries(self, size):
+        with CaptureQueriesContext(connection) as context:
+            self.post([
+                self.get_item(f'Рецепт {size}-{number}')
+                for number in range(size)
+            ], 201)
+        inserts = {}
+        for query in context.captured_queries:
+            if query['sql'].startswith('INSERT INTO'):
+                table = query['sql'].split()[2].strip('"')
+                inserts[table] = inserts.get(table, 0) + 1
+        return len(context.captured_queries), inserts
+
+    @override_settings(N_PLUS_ONE_THRESHOLD=100)
+    def test_query_count(self):
+        single, _ = self.count_queries(1)
+        total, inserts = self.count_queries(5)
+        for model in (IngredientRecipe, Recipe.tags.through):
+            self.assertEqual(inserts[model._meta.db_table], 1)
+        if connection.features.can_return_rows_from_bulk_insert:
+            self.assertEqual(total, single)
+            return
+        # Без RETURNING рецепты сохраняются по одному через save(),
+        # остальное по-прежнему вставляется одним запросом на таблицу.
+        with CaptureQueriesContext(connection) as context:
+            Recipe(author=self.author, name='Одиночный', text='Импорт',
+                   cooking_time=10, image='recipes/image/test.png').save()
+        self.assertEqual(total - single, 4 * len(context.captured_queries))
+
+
+class ResponseCacheTests(APITestCase):
+    """ Кеш анонимных ответов и представлений рецептов: ключ зависит
+        только от значимых параметров, а запись в базу сбрасывает
+        кеш после фиксации транзакции. """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('cached')
+        cls.tag = Tag.objects.create(
+            name='Кеш', color='#300000', slug='cached'
+        )
+        cls.recipes = [
+            Recipe.objects.create(
+                author=cls.author, name=f'Рецепт {number}', text='Описание',
+                cooking_time=10, image='recipes/image/test.png',
+            )
+            for number in range(3)
+        ]
+        for recipe in cls.recipes:
+            recipe.tags.set([cls.tag])
+        cls.recipe = cls.recipes[0]
+
+    def setUp(self):
+        cache.clear()
+        self.anonymous = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def get(self, client, path):
+        response = client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def get_names(self, client, path='/api/recipes/'):
+        return {
+            recipe['name'] for recipe in self.get(client, path)['results']
+        }
+
+    def rename_quietly(self, name):
+        """ Переименовать рецепт в обход сигналов, не сбрасывая кеш. """
+        Recipe.objects.filter(pk=self.recipe.pk).update(name=name)
+
+    def rename(self, name):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                f'/api/recipes/{self.recipe.pk}/', {'name': name},
+                format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+
+    def test_key_ignores_order_and_unknown_params(self):
+        self.get(self.anonymous, '/api/recipes/?tags=cached&limit=2&page=1')
+        for path in (
+            '/api/recipes/?page=1&limit=2&tags=cached',
+            '/api/recipes/?limit=2&utm_source=mail&tags=cached&page=1',
+        ):
+            with self.subTest(path), self.assertNumQueries(0):
+                self.get(self.anonymous, path)
+        with CaptureQueriesContext(connection) as context:
+            data = self.get(self.anonymous, '/api/recipes/?limit=2&page=2')
+        self.assertTrue(context.captured_queries)
+        self.assertEqual(len(data['results']), 1)
+
+    def test_anonymous_list_invalidated(self):
+        path = f'/api/recipes/?author={self.author.pk}'
+        self.assertIn('Рецепт 0', self.get_names(self.anonymous, path))
+        self.rename_quietly('Без сброса')
+        self.assertIn('Рецепт 0', self.get_names(self.anonymous, path))
+        self.rename('Новое название')
+        self.assertIn('Новое название', self.get_names(self.anonymous, path))
+
+    def test_anonymous_detail_invalidated(self):
+        path = f'/api/recipes/{self.recipe.pk}/'
+        self.get(self.anonymous, path)
+        self.rename_quietly('Без сброса')
+        self.assertEqual(self.get(self.anonymous, path)['name'], 'Рецепт 0')
+        with self.captureOnCommitCallbacks(execute=True):
+            Recipe.objects.filter(pk=self.recipes[1].pk).delete()
+        self.assertEqual(self.get(self.anonymous, path)['name'], 'Без сброса')
+
+    def test_fragments_invalidated(self):
+        self.assertIn('Рецепт 0', self.get_names(self.client))
+        self.rename_quietly('Без сброса')
+        self.assertIn('Рецепт 0', self.get_names(self.client))
+        self.rename('Новое название')
+        names = self.get_names(self.client)
+        self.assertIn('Новое название', names)
+        self.assertIn('Рецепт 1', names)
+
+
+class CatalogConditionTests(APITestCase):
+    """ Справочники отвечают 304 на совпавший If-None-Match, пока
+        их версия не сменилась после записи. """
+
+    @classmethod
+    def setUpTestData(cls):
+        Tag.objects.create(name='Завтрак', color='#400000', slug='breakfast')
+        Ingredient.objects.create(name='Соль', measurement_unit='г')
+
+    def setUp(self):
+        cache.clear()
+
+    def assert_not_modified_until_write(self, path, write):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+        with self.assertNumQueries(0):
+            response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            write()
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        return response.data
+
+    def test_tags(self):
+        data = self.assert_not_modified_until_write(
+            '/api/tags/', lambda: Tag.objects.create(
+                name='Ужин', color='#400001', slug='dinner'
+            )
+        )
+        self.assertEqual(len(data), 2)
+
+    def test_ingredients(self):
+        data = self.assert_not_modified_until_write(
+            '/api/ingredients/?name=с', lambda: Ingredient.objects.create(
+                name='Сахар', measurement_unit='г'
+            )
+        )
+        self.assertEqual(
+            {ingredient['name'] for ingredient in data}, {'Соль', 'Сахар'}
+        )
+
+    def test_etag_depends_on_query(self):
+        first = self.client.get('/api/ingredients/?name=с')
+        second = self.client.get('/api/ingredients/?name=са')
+        self.assertNotEqual(first['ETag'], second['ETag'])
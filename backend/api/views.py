@@ -1,28 +1,69 @@
-from django.db.models import Sum
-from django.http.response import HttpResponse
+from datetime import datetime, timezone
+from hashlib import md5
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, F, OuterRef, Prefetch, Subquery
+from django.http.response import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.parsers import JSONParser
 from rest_framework.permissions import (IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
 from rest_framework.response import Response
 
-from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
-                            ShoppingCart, Tag)
+from recipes.feed import get_pull_authors
+from recipes.models import (Favorite, FeedEntry, Ingredient, IngredientRecipe,
+                            Recipe, RecipeNeighbour, ShoppingCart,
+                            ShoppingListItem, Tag)
+from recipes.versions import get_version
 from users.models import Follow, User
 
+from .async_views import AsyncReadMixin
+from .cache import (cached_anonymous_response, get_recipe_fragments,
+                    overlay_user_data)
 from .filters import IngredientFilter, RecipeFilter
-from .pagination import CustomPagination
+from .pagination import CustomPagination, FeedPagination, RecipePagination
+from .parsers import NDJSONParser
 from .permissions import AuthorPermission
+from .renderers import (ShoppingListCSVRenderer, ShoppingListPDFRenderer,
+                        ShoppingListTextRenderer)
 from .serializers import (CreateRecipeSerializer, FavoriteSerializer,
-                          IngredientSerializer, RecipeReadSerializer,
-                          ShoppingCartSerializer, SubscribeListSerializer,
-                          TagSerializer, UserSerializer)
+                          IngredientSerializer, RecipeIdsSerializer,
+                          RecipeReadSerializer, ShoppingCartSerializer,
+                          SubscribeListSerializer, TagSerializer,
+                          UserSerializer, non_field_error)
+
+
+def catalog_condition(name):
+    """ ETag и Last-Modified по версии справочника: совпавший
+        If-None-Match получает 304 без обращения к базе. """
+
+    def etag(request, *args, **kwargs):
+        variant = '|'.join((
+            request.get_full_path(), request.META.get('HTTP_ACCEPT', '')
+        ))
+        return (f'{name}-{get_version(name)}-'
+                f'{md5(variant.encode()).hexdigest()}')
+
+    def last_modified(request, *args, **kwargs):
+        return datetime.fromtimestamp(get_version(name), tz=timezone.utc)
 
+    return method_decorator((
+        cache_control(no_cache=True),
+        condition(etag_func=etag, last_modified_func=last_modified),
+    ), name='dispatch')
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+
+@catalog_condition('ingredients')
+class IngredientViewSet(AsyncReadMixin, viewsets.ReadOnlyModelViewSet):
     """ Вывод ингредиентов """
     serializer_class = IngredientSerializer
     queryset = Ingredient.objects.all()
@@ -32,7 +73,8 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     pagination_class = None
 
 
-class TagViewSet(viewsets.ModelViewSet):
+@catalog_condition('tags')
+class TagViewSet(AsyncReadMixin, viewsets.ModelViewSet):
     """ Вывод тегов """
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
@@ -40,65 +82,220 @@ class TagViewSet(viewsets.ModelViewSet):
     pagination_class = None
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(AsyncReadMixin, viewsets.ModelViewSet):
     """ Вывод работы с рецептами """
     queryset = Recipe.objects.all()
     serializer_class = CreateRecipeSerializer
     permission_classes = (AuthorPermission, )
-    pagination_class = CustomPagination
+    pagination_class = RecipePagination
     filter_backends = (DjangoFilterBackend, )
     filterset_class = RecipeFilter
+    # Параметры, от которых зависит список: остальные не входят
+    # в ключ кеша анонимных ответов.
+    list_cache_params = (
+        *RecipeFilter.Meta.fields,
+        RecipePagination.page_query_param,
+        RecipePagination.page_size_query_param,
+        RecipePagination.pagination_query_param,
+        RecipePagination.keyset_class.cursor_query_param,
+    )
+
+    @staticmethod
+    def get_read_queryset():
+        return Recipe.objects.select_related('author').prefetch_related(
+            'tags',
+            Prefetch(
+                'ingredienttorecipe',
+                queryset=IngredientRecipe.objects.select_related('ingredient')
+            ),
+        )
+
+    def get_queryset(self):
+        user = self.request.user
+        if user.is_anonymous:
+            return self.get_read_queryset()
+        return self.get_read_queryset().select_related(None).prefetch_related(
+            Prefetch(
+                'author',
+                queryset=User.objects.annotate(is_subscribed=Exists(
+                    Follow.objects.filter(user=user, author=OuterRef('pk'))
+                ))
+            )
+        ).annotate(
+            is_favorited=Exists(
+                Favorite.objects.filter(user=user, recipe=OuterRef('pk'))
+            ),
+            is_in_shopping_cart=Exists(
+                ShoppingCart.objects.filter(user=user, recipe=OuterRef('pk'))
+            ),
+        )
 
     def get_serializer_class(self):
         if self.request.method == 'GET':
             return RecipeReadSerializer
         return CreateRecipeSerializer
 
-    @staticmethod
-    def send_message(ingredients):
-        shopping_list = 'Купить в магазине:'
-        for ingredient in ingredients:
-            shopping_list += (
-                f"\n{ingredient['ingredient__name']} "
-                f"({ingredient['ingredient__measurement_unit']}) - "
-                f"{ingredient['amount']}")
-        file = 'shopping_list.txt'
-        response = HttpResponse(shopping_list, content_type='text/plain')
-        response['Content-Disposition'] = f'attachment; filename="{file}.txt"'
-        return response
+    def build_fragments(self, ids):
+        return RecipeReadSerializer(
+            self.get_read_queryset().filter(id__in=ids), many=True
+        ).data
+
+    def list(self, request, *args, **kwargs):
+        if request.user.is_anonymous:
+            return cached_anonymous_response(
+                'recipes', super().list, request, *args,
+                params=self.list_cache_params, **kwargs
+            )
+        page = self.paginate_queryset(self.filter_queryset(
+            Recipe.objects.only('id', 'pub_date')
+        ))
+        fragments = get_recipe_fragments(
+            [recipe.id for recipe in page], self.build_fragments
+        )
+        return self.get_paginated_response(
+            overlay_user_data(request, fragments)
+        )
 
-    @action(detail=False, methods=['GET'])
+    def retrieve(self, request, *args, **kwargs):
+        return cached_anonymous_response(
+            'recipes', super().retrieve, request, *args, **kwargs
+        )
+
+    @action(
+        detail=False,
+        permission_classes=[IsAuthenticated],
+        pagination_class=FeedPagination)
+    def feed(self, request):
+        user = request.user
+        page = self.paginate_queryset((
+            (FeedEntry.objects.filter(user=user), 'recipe_id'),
+            (Recipe.objects.filter(author__in=get_pull_authors().filter(
+                following__user=user
+            )), 'id'),
+        ))
+        fragments = get_recipe_fragments(
+            [item.pk for item in page], self.build_fragments
+        )
+        return self.get_paginated_response(
+            overlay_user_data(request, fragments)
+        )
+
+    @action(detail=True)
+    def similar(self, request, pk):
+        ids = list(RecipeNeighbour.objects.filter(recipe_id=pk).order_by(
+            '-score', 'similar_id'
+        ).values_list(
+            'similar_id', flat=True
+        )[:settings.SIMILAR_RECIPES_COUNT])
+        if not ids:
+            get_object_or_404(Recipe, id=pk)
+        fragments = get_recipe_fragments(ids, self.build_fragments)
+        return Response(overlay_user_data(request, fragments))
+
+    @action(
+        detail=False,
+        methods=('POST',),
+        permission_classes=[IsAuthenticated],
+        parser_classes=(JSONParser, NDJSONParser))
+    def bulk(self, request):
+        if not isinstance(request.data, list):
+            raise ValidationError({'detail': 'Ожидается список рецептов'})
+        context = {
+            'request': request,
+            'lookups': {
+                Tag: Tag.objects.in_bulk(),
+                Ingredient: Ingredient.objects.in_bulk(),
+            },
+        }
+        valid, errors = [], []
+        for index, item in enumerate(request.data):
+            serializer = CreateRecipeSerializer(data=item, context=context)
+            if serializer.is_valid():
+                valid.append(serializer.validated_data)
+            else:
+                errors.append({'index': index, 'errors': serializer.errors})
+        recipes = CreateRecipeSerializer.bulk_create(valid, request.user)
+        return Response(
+            {'created': [recipe.id for recipe in recipes], 'errors': errors},
+            status=(status.HTTP_201_CREATED if recipes
+                    else status.HTTP_400_BAD_REQUEST)
+        )
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        users = list(instance.shopping_list.values_list('user', flat=True))
+        ingredients = list(instance.ingredients.values_list('id', flat=True))
+        instance.delete()
+        if users:
+            ShoppingListItem.objects.refresh(users, ingredients)
+
+    @action(
+        detail=False,
+        methods=['GET'],
+        permission_classes=[IsAuthenticated],
+        renderer_classes=(ShoppingListTextRenderer, ShoppingListCSVRenderer,
+                          ShoppingListPDFRenderer))
     def download_shopping_cart(self, request):
-        ingredients = IngredientRecipe.objects.filter(
-            recipe__shopping_list__user=request.user
+        ingredients = ShoppingListItem.objects.filter(
+            user=request.user
         ).order_by('ingredient__name').values(
-            'ingredient__name', 'ingredient__measurement_unit'
-        ).annotate(amount=Sum('amount'))
-        return self.send_message(ingredients)
+            'ingredient__name', 'ingredient__measurement_unit',
+            amount=F('total_amount')
+        )
+        renderer = request.accepted_renderer
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type = f'{content_type}; charset={renderer.charset}'
+        response = StreamingHttpResponse(
+            renderer.stream(ingredients.iterator()),
+            content_type=content_type
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="shopping_list.{renderer.format}"'
+        )
+        return response
+
+    @staticmethod
+    def add_recipe(request, pk, serializer_class):
+        recipe = get_object_or_404(Recipe, id=pk)
+        serializer = serializer_class(data={}, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        serializer.save(user=request.user, recipe=recipe)
+        return serializer
+
+    @staticmethod
+    def remove_recipe(request, pk, model):
+        deleted, _ = model.objects.filter(
+            user=request.user, recipe_id=pk
+        ).delete()
+        if not deleted:
+            raise NotFound
 
     @action(
         detail=True,
         methods=('POST',),
         permission_classes=[IsAuthenticated])
     def shopping_cart(self, request, pk):
-        context = {'request': request}
-        recipe = get_object_or_404(Recipe, id=pk)
-        data = {
-            'user': request.user.id,
-            'recipe': recipe.id
-        }
-        serializer = ShoppingCartSerializer(data=data, context=context)
-        serializer.is_valid(raise_exception=True)
-        serializer.save()
+        with transaction.atomic():
+            serializer = self.add_recipe(request, pk, ShoppingCartSerializer)
+            ShoppingListItem.objects.refresh(
+                [request.user.id],
+                IngredientRecipe.objects.filter(
+                    recipe_id=pk
+                ).values('ingredient')
+            )
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     @shopping_cart.mapping.delete
     def destroy_shopping_cart(self, request, pk):
-        get_object_or_404(
-            ShoppingCart,
-            user=request.user.id,
-            recipe=get_object_or_404(Recipe, id=pk)
-        ).delete()
+        with transaction.atomic():
+            self.remove_recipe(request, pk, ShoppingCart)
+            ShoppingListItem.objects.refresh(
+                [request.user.id],
+                IngredientRecipe.objects.filter(
+                    recipe_id=pk
+                ).values('ingredient')
+            )
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(
@@ -106,31 +303,104 @@ class RecipeViewSet(viewsets.ModelViewSet):
         methods=('POST',),
         permission_classes=[IsAuthenticated])
     def favorite(self, request, pk):
-        context = {"request": request}
-        recipe = get_object_or_404(Recipe, id=pk)
-        data = {
-            'user': request.user.id,
-            'recipe': recipe.id
-        }
-        serializer = FavoriteSerializer(data=data, context=context)
-        serializer.is_valid(raise_exception=True)
-        serializer.save()
+        serializer = self.add_recipe(request, pk, FavoriteSerializer)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     @favorite.mapping.delete
     def destroy_favorite(self, request, pk):
-        get_object_or_404(
-            Favorite,
-            user=request.user,
-            recipe=get_object_or_404(Recipe, id=pk)
-        ).delete()
+        self.remove_recipe(request, pk, Favorite)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @staticmethod
+    def change_batch(request, model, counter):
+        """ Добавить или убрать рецепты из избранного или корзины
+            пачкой: одна выборка рецептов, одна вставка или удаление.
+            Строки рецептов блокируются до конца транзакции, поэтому
+            параллельные запросы с теми же рецептами ждут друг друга,
+            и счётчики меняются только на действительно изменённое. """
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        requested = set(serializer.validated_data['recipes'])
+        with transaction.atomic():
+            found = set(Recipe.objects.select_for_update().filter(
+                id__in=requested
+            ).order_by('id').values_list('id', flat=True))
+            entries = model.objects.filter(
+                user=request.user, recipe_id__in=found
+            )
+            present = set(entries.select_for_update().values_list(
+                'recipe_id', flat=True
+            ))
+            if request.method == 'POST':
+                model.objects.bulk_create(
+                    (model(user=request.user, recipe_id=recipe_id)
+                     for recipe_id in found - present),
+                    ignore_conflicts=True
+                )
+                changed = set(
+                    entries.values_list('recipe_id', flat=True)
+                ) - present
+                Recipe.objects.filter(id__in=changed).update(
+                    **{counter: F(counter) + 1}
+                )
+                result = {'added': changed, 'already_present': present}
+            else:
+                # Счётчики уменьшают сигналы post_delete удалённых строк.
+                changed = present
+                entries.delete()
+                result = {'removed': changed, 'not_present': found - present}
+            if model is ShoppingCart and changed:
+                ShoppingListItem.objects.refresh(
+                    [request.user.id],
+                    IngredientRecipe.objects.filter(
+                        recipe_id__in=changed
+                    ).values('ingredient')
+                )
+        result['missing'] = requested - found
+        return Response({
+            key: sorted(recipe_ids) for key, recipe_ids in result.items()
+        })
+
+    @action(
+        detail=False,
+        methods=('POST', 'DELETE'),
+        url_path='favorite/batch',
+        permission_classes=[IsAuthenticated])
+    def favorite_batch(self, request):
+        return self.change_batch(request, Favorite, 'favorites_count')
 
-class UserViewSet(UserViewSet):
+    @action(
+        detail=False,
+        methods=('POST', 'DELETE'),
+        url_path='shopping_cart/batch',
+        permission_classes=[IsAuthenticated])
+    def shopping_cart_batch(self, request):
+        return self.change_batch(
+            request, ShoppingCart, 'shopping_cart_count'
+        )
+
+
+def get_recipes_limit(request):
+    """ Параметр recipes_limit: число или None, если он не задан
+        или задан не числом. """
+    limit = request.query_params.get('recipes_limit', '')
+    return int(limit) if limit.isdigit() else None
+
+
+class UserViewSet(AsyncReadMixin, UserViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     pagination_class = CustomPagination
+    async_read_actions = ('subscriptions', )
+
+    def get_queryset(self):
+        user = self.request.user
+        queryset = super().get_queryset()
+        if user.is_anonymous:
+            return queryset
+        return queryset.annotate(is_subscribed=Exists(
+            Follow.objects.filter(user=user, author=OuterRef('pk'))
+        ))
 
     @action(
         detail=True,
@@ -139,28 +409,43 @@ class UserViewSet(UserViewSet):
     )
     def subscribe(self, request, id):
         user = request.user
-        author = get_object_or_404(User, pk=id)
 
         if request.method == 'POST':
-            serializer = SubscribeListSerializer(
-                author, data=request.data, context={'request': request}
-            )
-            serializer.is_valid(raise_exception=True)
-            Follow.objects.create(user=user, author=author)
+            author = get_object_or_404(User, pk=id)
+            if user == author:
+                raise non_field_error('Нельзя подписаться на самого себя')
+            try:
+                with transaction.atomic():
+                    Follow.objects.create(user=user, author=author)
+            except IntegrityError:
+                raise non_field_error('Подписка уже существует')
+            serializer = SubscribeListSerializer(author, context={
+                'request': request,
+                'recipes_limit': get_recipes_limit(request),
+            })
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-        if request.method == 'DELETE':
-            get_object_or_404(
-                Follow, user=user, author=author
-            ).delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
+        deleted, _ = Follow.objects.filter(user=user, author_id=id).delete()
+        if not deleted:
+            raise NotFound
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(detail=False, permission_classes=[IsAuthenticated])
     def subscriptions(self, request):
         user = request.user
-        queryset = User.objects.filter(following__user=user)
-        pages = self.paginate_queryset(queryset)
-        serializer = SubscribeListSerializer(
-            pages, many=True, context={'request': request}
+        recipes = Recipe.objects.all()
+        limit = get_recipes_limit(request)
+        if limit is not None:
+            recipes = recipes.filter(id__in=Subquery(
+                Recipe.objects.filter(
+                    author=OuterRef('author')
+                ).order_by('-pub_date', '-id').values('id')[:limit]
+            ))
+        queryset = User.objects.filter(following__user=user).prefetch_related(
+            Prefetch('recipes', queryset=recipes)
         )
+        pages = self.paginate_queryset(queryset)
+        serializer = SubscribeListSerializer(pages, many=True, context={
+            'request': request, 'recipes_limit': limit,
+        })
         return self.get_paginated_response(serializer.data)
@@ -0,0 +1,180 @@
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import (DEFAULT_DB_ALIAS, DatabaseError, InterfaceError,
+                       OperationalError, connections)
+
+logger = logging.getLogger('foodgram.db')
+
+# Отставание реплики PostgreSQL в секундах. Если всё, что реплика
+# получила, уже применено, отставания нет, даже когда основная база
+# давно ничего не записывала.
+POSTGRES_LAG_SQL = (
+    'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() '
+    'THEN 0 ELSE COALESCE(EXTRACT(EPOCH FROM '
+    'now() - pg_last_xact_replay_timestamp()), 0) END'
+)
+
+
+class RoutingState:
+    """ Маршрутизация чтений одного запроса, её ставит
+        replica_routing_middleware. """
+
+    def __init__(self, replicas_allowed=False):
+        self.replicas_allowed = replicas_allowed
+        self.wrote = False
+        self.primary_depth = 0
+        self.replica = None
+
+
+routing_state = ContextVar('routing_state', default=None)
+
+
+class ReplicaHealth:
+    """ Доступность реплик в процессе. Реплика проверяется не чаще
+        раза в REPLICA_HEALTH_INTERVAL секунд; недоступная или отставшая
+        больше REPLICA_MAX_LAG исключается до следующей проверки. """
+
+    def __init__(self):
+        self._checked = {}
+
+    def check(self, alias):
+        connection = connections[alias]
+        try:
+            connection.ensure_connection()
+            # Курсор драйвера, мимо execute_wrappers: record_replica_failure
+            # повторил бы упавшую проверку на основной базе.
+            with connection.wrap_database_errors:
+                cursor = connection.connection.cursor()
+                try:
+                    if connection.vendor == 'postgresql':
+                        cursor.execute(POSTGRES_LAG_SQL)
+                        lag = cursor.fetchone()[0]
+                    else:
+                        # Таблица, а не SELECT 1: пустая база тоже ответит.
+                        cursor.execute(
+                            'SELECT 1 FROM django_migrations LIMIT 1'
+                        )
+                        lag = 0
+                finally:
+                    cursor.close()
+        except DatabaseError as error:
+            logger.warning('Реплика %s недоступна: %s', alias, error)
+            connection.close()
+            return False
+        if lag > settings.REPLICA_MAX_LAG:
+            logger.warning('Реплика %s отстаёт на %.1f с', alias, lag)
+            return False
+        return True
+
+    def is_healthy(self, alias):
+        checked, healthy = self._checked.get(alias, (None, True))
+        now = time.monotonic()
+        if (checked is None
+                or now - checked >= settings.REPLICA_HEALTH_INTERVAL):
+            healthy = self.check(alias)
+            self._checked[alias] = (now, healthy)
+        return healthy
+
+    def mark_failed(self, alias):
+        self._checked[alias] = (time.monotonic(), False)
+
+    def connect(self, alias):
+        try:
+            connections[alias].ensure_connection()
+        except DatabaseError as error:
+            logger.warning('Реплика %s недоступна: %s', alias, error)
+            self.mark_failed(alias)
+            return False
+        return True
+
+    def choose(self):
+        """ Случайная здоровая реплика, к которой удалось подключиться. """
+        healthy = [
+            alias for alias in settings.DATABASE_REPLICAS
+            if self.is_healthy(alias)
+        ]
+        random.shuffle(healthy)
+        for alias in healthy:
+            if self.connect(alias):
+                return alias
+        return None
+
+
+replica_health = ReplicaHealth()
+
+
+class ReplicaRouter:
+    """ Чтения безопасных запросов — на реплику, одну на весь запрос.
+        На основную базу идут: записи и все чтения запроса после первой
+        записи, чтения в транзакции, внутри primary_reads и вне запросов
+        (команды, shell). Если здоровых реплик нет — тоже основная. """
+
+    def db_for_read(self, model, **hints):
+        state = routing_state.get()
+        if (state is None or not state.replicas_allowed or state.wrote
+                or state.primary_depth
+                or connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return DEFAULT_DB_ALIAS
+        if state.replica is None:
+            state.replica = replica_health.choose() or DEFAULT_DB_ALIAS
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = routing_state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def primary_reads():
+    """ Читать с основной базы: для данных, которые кладутся в общий
+        кеш, чтобы отставшая реплика не закрепила устаревшую копию. """
+    state = routing_state.get()
+    if state is None:
+        yield
+        return
+    state.primary_depth += 1
+    try:
+        yield
+    finally:
+        state.primary_depth -= 1
+
+
+def record_replica_failure(execute, sql, params, many, context):
+    """ Обёртка execute_wrapper реплик: если реплика не выполнила запрос,
+        она исключается до следующей проверки, а запрос один раз
+        повторяется на основной базе, и строки читаются уже оттуда.
+        Следующие SQL-запросы идут на основную базу. """
+    try:
+        return execute(sql, params, many, context)
+    except (OperationalError, InterfaceError) as error:
+        logger.warning('Реплика %s не выполнила запрос: %s',
+                       context['connection'].alias, error)
+        replica_health.mark_failed(context['connection'].alias)
+        state = routing_state.get()
+        if state is not None:
+            state.replica = DEFAULT_DB_ALIAS
+    primary = connections[DEFAULT_DB_ALIAS].cursor()
+    context['cursor'].cursor = primary.cursor
+    if many:
+        return primary.executemany(sql, params)
+    return primary.execute(sql, params)
+
+
+def install_replica_failure_handler(sender, connection, **kwargs):
+    """ Обработчик connection_created для соединений реплик. """
+    if (connection.alias in settings.DATABASE_REPLICAS
+            and record_replica_failure not in connection.execute_wrappers):
+        connection.execute_wrappers.append(record_replica_failure)
@@ -0,0 +1,17 @@
+import os
+
+
+def on_starting(server):
+    """ Версии данных, журнал индекса ингредиентов и сводка по эндпоинтам
+        живут в кеше. Локальный кеш процесса у каждого воркера свой,
+        и воркеры перестают видеть изменения друг друга, поэтому
+        с несколькими воркерами нужен общий кеш. """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
+    from django.conf import settings
+    backend = settings.CACHES['default']['BACKEND']
+    if server.cfg.workers > 1 and backend.endswith('.LocMemCache'):
+        raise SystemExit(
+            f'{server.cfg.workers} воркеров не могут работать с {backend}: '
+            'задайте CACHE_BACKEND и CACHE_LOCATION общего кеша, '
+            'например memcached'
+        )
@@ -1,7 +1,38 @@
+from contextlib import contextmanager
+
 from django.contrib import admin
+from django.db import transaction
 
 from .models import (Favorite, Ingredient, IngredientRecipe, Recipe,
-                     ShoppingCart, Tag)
+                     ShoppingCart, ShoppingListItem, Tag)
+from .search import publish_recipe_ingredients
+
+
+@contextmanager
+def refresh_shopping_lists(recipe_ids):
+    """ Пересчитать сводные списки покупок пользователей, у которых
+        рецепты лежат в корзине до или после изменения, по ингредиентам
+        этих рецептов до и после него. """
+
+    def get_affected():
+        return (
+            set(ShoppingCart.objects.filter(
+                recipe_id__in=recipe_ids
+            ).values_list('user', flat=True)),
+            set(IngredientRecipe.objects.filter(
+                recipe_id__in=recipe_ids
+            ).values_list('ingredient', flat=True)),
+        )
+
+    with transaction.atomic():
+        users, ingredients = get_affected()
+        yield
+        users_after, ingredients_after = get_affected()
+        users |= users_after
+        if users:
+            ShoppingListItem.objects.refresh(
+                users, ingredients | ingredients_after
+            )
 
 
 class IngredientInline(admin.TabularInline):
@@ -19,8 +50,27 @@ class RecipeAdmin(admin.ModelAdmin):
     inlines = (IngredientInline,)
     empty_value_display = '-пусто-'
 
+    def save_related(self, request, form, formsets, change):
+        with refresh_shopping_lists([form.instance.pk]):
+            super().save_related(request, form, formsets, change)
+        publish_recipe_ingredients({
+            form.instance.pk: form.instance.ingredienttorecipe.values_list(
+                'ingredient_id', flat=True
+            )
+        })
+
+    def delete_model(self, request, obj):
+        with refresh_shopping_lists([obj.pk]):
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with refresh_shopping_lists(list(queryset.values_list(
+            'pk', flat=True
+        ))):
+            super().delete_queryset(request, queryset)
+
     def get_favorites(self, obj):
-        return obj.favorites.count()
+        return obj.favorites_count
     get_favorites.short_description = 'Избранное'
 
     def get_ingredients(self, obj):
@@ -61,6 +111,24 @@ class ShoppingCartAdmin(admin.ModelAdmin):
     search_fields = ('user', )
     empty_value_display = '-пусто-'
 
+    def save_model(self, request, obj, form, change):
+        # Прежний рецепт записи тоже затронут, если его сменили.
+        recipe_ids = {obj.recipe_id, *ShoppingCart.objects.filter(
+            pk=obj.pk
+        ).values_list('recipe_id', flat=True)}
+        with refresh_shopping_lists(recipe_ids):
+            super().save_model(request, obj, form, change)
+
+    def delete_model(self, request, obj):
+        with refresh_shopping_lists([obj.recipe_id]):
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with refresh_shopping_lists(list(queryset.values_list(
+            'recipe_id', flat=True
+        ))):
+            super().delete_queryset(request, queryset)
+
 
 admin.site.register(ShoppingCart, ShoppingCartAdmin)
 admin.site.register(Ingredient, IngredientAdmin)
@@ -3,3 +3,10 @@ from django.apps import AppConfig
 
 class RecipesConfig(AppConfig):
     name = 'recipes'
+
+    def ready(self):
+        from django.db.models.signals import post_migrate
+
+        from . import signals  # noqa: F401
+        from .search import install_recipe_search
+        post_migrate.connect(install_recipe_search, sender=self)
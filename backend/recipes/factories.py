@@ -0,0 +1,129 @@
+from io import BytesIO
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.db.models import Max
+from PIL import Image
+
+from users.models import User
+
+from .models import IngredientRecipe, Recipe
+
+PASSWORD = 'foodgram-bench'
+PLACEHOLDER_IMAGE = 'recipes/image/generated.png'
+FIRST_NAMES = ('Анна', 'Иван', 'Мария', 'Пётр', 'Ольга', 'Сергей', 'Елена',
+               'Дмитрий', 'Наталья', 'Алексей')
+LAST_NAMES = ('Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев',
+              'Соколов', 'Михайлов', 'Новиков', 'Фёдоров', 'Морозов')
+DISH_ADJECTIVES = ('Домашний', 'Быстрый', 'Пряный', 'Летний', 'Зимний',
+                   'Сырный', 'Овощной', 'Бабушкин', 'Праздничный', 'Лёгкий')
+DISHES = ('суп', 'пирог', 'салат', 'плов', 'омлет', 'рагу', 'соус',
+          'запеканка', 'десерт', 'гарнир')
+SENTENCES = ('Нарежьте всё кубиками.', 'Обжарьте на среднем огне.',
+             'Добавьте специи по вкусу.', 'Готовьте под крышкой.',
+             'Подавайте горячим.', 'Дайте настояться десять минут.')
+
+
+def skewed_choice(rng, sequence, skew):
+    """ Элемент с перекосом к началу: при skew > 1 первые элементы
+        выбираются чаще, как популярные авторы и рецепты. """
+    return sequence[int(len(sequence) * rng.random() ** skew)]
+
+
+def get_placeholder_image():
+    if not default_storage.exists(PLACEHOLDER_IMAGE):
+        buffer = BytesIO()
+        Image.new('RGB', (640, 480), (230, 150, 60)).save(buffer, 'PNG')
+        default_storage.save(PLACEHOLDER_IMAGE, ContentFile(buffer.getvalue()))
+    return PLACEHOLDER_IMAGE
+
+
+def bulk_create_ids(model, objects, batch_size):
+    """ id вставленных строк: из RETURNING, а если база его не умеет,
+        по диапазону после прежнего максимума (вставка в один поток). """
+    if connection.features.can_return_rows_from_bulk_insert:
+        return [obj.pk for obj in model.objects.bulk_create(
+            objects, batch_size
+        )]
+    last = model.objects.aggregate(last=Max('pk'))['last'] or 0
+    model.objects.bulk_create(objects, batch_size)
+    return list(model.objects.filter(pk__gt=last).order_by(
+        'pk'
+    ).values_list('pk', flat=True))
+
+
+def create_users(rng, count, prefix, batch_size=1000):
+    password = make_password(PASSWORD)
+    ids = []
+    for start in range(0, count, batch_size):
+        ids += bulk_create_ids(User, [
+            User(
+                username=f'{prefix}{number}',
+                email=f'{prefix}{number}@example.com',
+                first_name=rng.choice(FIRST_NAMES),
+                last_name=rng.choice(LAST_NAMES),
+                password=password,
+            )
+            for number in range(start, min(start + batch_size, count))
+        ], batch_size)
+    return ids
+
+
+def create_recipes(rng, count, authors, tags, ingredients,
+                   ingredients_per_recipe=8, tags_per_recipe=2,
+                   batch_size=1000):
+    """ Рецепты с ингредиентами и тегами; авторы выбираются
+        с перекосом, чтобы у части из них было много рецептов. """
+    image = get_placeholder_image()
+    recipe_tag = Recipe.tags.through
+    ids = []
+    for start in range(0, count, batch_size):
+        size = min(batch_size, count - start)
+        batch = bulk_create_ids(Recipe, [
+            Recipe(
+                author_id=skewed_choice(rng, authors, 2),
+                name=f'{rng.choice(DISH_ADJECTIVES)} {rng.choice(DISHES)}',
+                text=' '.join(rng.choices(SENTENCES, k=rng.randint(2, 6))),
+                cooking_time=rng.randint(5, 180),
+                image=image,
+            )
+            for _ in range(size)
+        ], batch_size)
+        IngredientRecipe.objects.bulk_create([
+            IngredientRecipe(
+                recipe_id=recipe, ingredient_id=ingredient,
+                amount=rng.randint(1, 500)
+            )
+            for recipe in batch
+            for ingredient in rng.sample(ingredients, min(
+                len(ingredients),
+                rng.randint(1, 2 * ingredients_per_recipe - 1)
+            ))
+        ], batch_size)
+        recipe_tag.objects.bulk_create([
+            recipe_tag(recipe_id=recipe, tag_id=tag)
+            for recipe in batch
+            for tag in rng.sample(tags, rng.randint(
+                1, min(len(tags), tags_per_recipe)
+            ))
+        ], batch_size)
+        ids += batch
+    return ids
+
+
+def create_pairs(rng, model, fields, users, targets, count, skew=2,
+                 batch_size=1000):
+    """ Пары пользователь — объект для избранного, корзины и подписок.
+        Повторы отбрасываются, поэтому вставок может быть меньше count. """
+    user_field, target_field = fields
+    for start in range(0, count, batch_size):
+        pairs = {
+            (rng.choice(users), skewed_choice(rng, targets, skew))
+            for _ in range(min(batch_size, count - start))
+        }
+        model.objects.bulk_create([
+            model(**{user_field: user, target_field: target})
+            for user, target in pairs if user != target
+        ], batch_size, ignore_conflicts=True)
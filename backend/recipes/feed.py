@@ -0,0 +1,90 @@
+from collections import defaultdict
+
+from django.conf import settings
+
+from users.models import Follow, User
+
+from .models import FeedEntry, Recipe
+
+FEED_BATCH_SIZE = 1000
+
+
+def get_pull_authors():
+    """ Авторы, чьи рецепты не раскладываются по лентам:
+        у них слишком много подписчиков, лента читает их сама. """
+    return User.objects.filter(
+        followers_count__gte=settings.FEED_FANOUT_LIMIT
+    )
+
+
+def fan_out(recipes, batch_size=FEED_BATCH_SIZE):
+    """ Разложить рецепты по лентам подписчиков их авторов. """
+    by_author = defaultdict(list)
+    for recipe in recipes:
+        by_author[recipe.author_id].append(recipe)
+    if not by_author:
+        return
+    pull = set(get_pull_authors().filter(
+        pk__in=by_author
+    ).values_list('pk', flat=True))
+    followers = Follow.objects.filter(
+        author__in=by_author.keys() - pull
+    ).values_list('author', 'user').iterator()
+    entries = []
+    for author, user in followers:
+        entries += [
+            FeedEntry(user_id=user, recipe_id=recipe.id,
+                      pub_date=recipe.pub_date)
+            for recipe in by_author[author]
+        ]
+        if len(entries) >= batch_size:
+            FeedEntry.objects.bulk_create(entries, ignore_conflicts=True)
+            entries = []
+    FeedEntry.objects.bulk_create(entries, ignore_conflicts=True)
+
+
+def get_followers_count(author):
+    """ Число подписчиков из базы: сигнал подписки уже изменил счётчик. """
+    return User.objects.filter(pk=author).values_list(
+        'followers_count', flat=True
+    ).first() or 0
+
+
+def backfill(user, author):
+    """ Добавить в ленту недавние рецепты нового автора. Если с этой
+        подпиской автор дошёл до FEED_FANOUT_LIMIT, ленты читают его
+        рецепты сами, и разложенные записи больше не нужны. """
+    followers = get_followers_count(author.pk)
+    if followers >= settings.FEED_FANOUT_LIMIT:
+        if followers == settings.FEED_FANOUT_LIMIT:
+            FeedEntry.objects.filter(recipe__author=author).delete()
+        return
+    FeedEntry.objects.bulk_create((
+        FeedEntry(user=user, recipe_id=recipe_id, pub_date=pub_date)
+        for recipe_id, pub_date in Recipe.objects.filter(
+            author=author
+        ).order_by('-pub_date', '-id').values_list(
+            'id', 'pub_date'
+        )[:settings.FEED_BACKFILL]
+    ), ignore_conflicts=True)
+
+
+def remove(user, author):
+    """ Убрать рецепты автора из ленты отписавшегося. Если подписчиков
+        стало меньше FEED_FANOUT_LIMIT, ленты больше не читают автора
+        сами, и его недавние рецепты раскладываются по ним заново. """
+    FeedEntry.objects.filter(user=user, recipe__author=author).delete()
+    if get_followers_count(author) == settings.FEED_FANOUT_LIMIT - 1:
+        rebuild([author])
+
+
+def rebuild(authors):
+    """ Заново разложить недавние рецепты авторов по лентам. """
+    FeedEntry.objects.filter(recipe__author__in=authors).delete()
+    recent = defaultdict(list)
+    for recipe in Recipe.objects.filter(author__in=authors).order_by(
+        'author', '-pub_date', '-id'
+    ).only('id', 'author_id', 'pub_date').iterator():
+        if len(recent[recipe.author_id]) < settings.FEED_BACKFILL:
+            recent[recipe.author_id].append(recipe)
+    fan_out(recipe for recipes in recent.values() for recipe in recipes)
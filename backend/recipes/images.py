@@ -0,0 +1,82 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, connection, transaction
+from PIL import Image
+
+from .models import Recipe
+from .versions import bump_version, get_recipe_fragment_key
+
+logger = logging.getLogger(__name__)
+
+VARIANTS_DIR = 'recipes/variants/'
+VARIANT_FORMATS = (('webp', 'WEBP'), ('jpg', 'JPEG'))
+VARIANT_QUALITY = 80
+
+executor = ThreadPoolExecutor(
+    max_workers=max(settings.RECIPE_IMAGE_WORKERS, 1),
+    thread_name_prefix='recipe-images'
+)
+
+
+def get_variant_name(name, variant, extension):
+    root = os.path.splitext(os.path.basename(name))[0]
+    return f'{VARIANTS_DIR}{root}_{variant}.{extension}'
+
+
+def save_variant(image, target, image_format):
+    if default_storage.exists(target):
+        return
+    if image_format == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    buffer = BytesIO()
+    image.save(buffer, image_format, quality=VARIANT_QUALITY)
+    default_storage.save(target, ContentFile(buffer.getvalue()))
+
+
+def build_variants(name):
+    """ Сделать уменьшенные копии картинки в WebP и JPEG
+        и записать их адреса всем рецептам с этой картинкой. """
+    with default_storage.open(name) as image_file:
+        original = Image.open(image_file)
+        original.load()
+    if original.mode not in ('RGB', 'RGBA'):
+        original = original.convert('RGBA')
+    variants = {}
+    for variant, size in settings.RECIPE_IMAGE_VARIANTS.items():
+        image = original.copy()
+        image.thumbnail((size, size))
+        for extension, image_format in VARIANT_FORMATS:
+            target = get_variant_name(name, variant, extension)
+            save_variant(image, target, image_format)
+            variants.setdefault(variant, {})[extension] = target
+    recipes = Recipe.objects.filter(image=name)
+    ids = list(recipes.values_list('id', flat=True))
+    recipes.update(image_variants=variants)
+    bump_version('recipes')
+    cache.delete_many([get_recipe_fragment_key(pk) for pk in ids])
+    return variants
+
+
+def run_build_variants(name):
+    close_old_connections()
+    try:
+        build_variants(name)
+    except Exception:
+        logger.exception('Не удалось обработать картинку %s', name)
+    finally:
+        connection.close()
+
+
+def schedule_variants(name):
+    """ Обработать картинку в фоне после фиксации транзакции. """
+    if not settings.RECIPE_IMAGE_WORKERS:
+        transaction.on_commit(lambda: build_variants(name))
+        return
+    transaction.on_commit(lambda: executor.submit(run_build_variants, name))
@@ -0,0 +1,237 @@
+import json
+import logging
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.error import URLError
+from urllib.parse import quote
+from urllib.request import Request, urlopen
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, setup_test_environment
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from recipes.models import Ingredient, Recipe, ShoppingCart
+from users.models import User
+
+ENDPOINTS = {
+    'recipes_anonymous': ('anonymous', '/api/recipes/'),
+    'recipes': ('user', '/api/recipes/'),
+    'recipes_cursor': ('user', '/api/recipes/?pagination=cursor&limit=20'),
+    'recipes_search': ('user', '/api/recipes/?search={search}'),
+    'recipes_by_ingredients': (
+        'user', '/api/recipes/?ingredients={ingredient}&max_missing=3'
+    ),
+    'recipe_detail': ('user', '/api/recipes/{recipe}/'),
+    'similar': ('user', '/api/recipes/{recipe}/similar/'),
+    'feed': ('user', '/api/recipes/feed/?limit=20'),
+    'subscriptions': ('user', '/api/users/subscriptions/?recipes_limit=3'),
+    'download_shopping_cart': (
+        'user', '/api/recipes/download_shopping_cart/'
+    ),
+    'ingredients_search': ('anonymous', '/api/ingredients/?name={prefix}'),
+    'users': ('user', '/api/users/'),
+}
+
+
+def percentile(values, share):
+    ordered = sorted(values)
+    return ordered[round(share * (len(ordered) - 1))]
+
+
+class Command(BaseCommand):
+    help = ' Замерить время, SQL-запросы и память основных эндпоинтов '
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--endpoints', nargs='+', choices=ENDPOINTS,
+            default=list(ENDPOINTS),
+        )
+        parser.add_argument(
+            '--requests', type=int, default=50,
+            help='Сколько замеров делать для каждого эндпоинта',
+        )
+        parser.add_argument(
+            '--warmup', type=int, default=3,
+            help='Сколько запросов не учитывать в начале',
+        )
+        parser.add_argument(
+            '--cold', action='store_true',
+            help='Очищать кеш перед каждым запросом',
+        )
+        parser.add_argument('--user', help='email пользователя для замеров')
+        parser.add_argument('--save-baseline', help='Записать итог в JSON')
+        parser.add_argument('--baseline', help='Сравнить с итогом из JSON')
+        parser.add_argument(
+            '--tolerance', type=float, default=0.2,
+            help='Допустимый рост p95 и памяти относительно базы',
+        )
+        parser.add_argument(
+            '--base-url',
+            help='Слать HTTP-запросы запущенному серверу, например '
+                 'http://localhost:8000, вместо тестового клиента',
+        )
+        parser.add_argument(
+            '--concurrency', type=int, default=1,
+            help='Сколько запросов к серверу держать одновременно',
+        )
+
+    def get_user(self, email):
+        if email:
+            user = User.objects.filter(email=email).first()
+            if user is None:
+                raise CommandError(f'Пользователь {email} не найден')
+            return user
+        user_id = ShoppingCart.objects.values_list('user', flat=True).first()
+        user = User.objects.filter(pk=user_id).first() or (
+            User.objects.order_by('pk').first()
+        )
+        if user is None:
+            raise CommandError('Нет данных: выполните generate_data')
+        return user
+
+    def get_clients(self, user):
+        token, _ = Token.objects.get_or_create(user=user)
+        if self.options['base_url']:
+            return {
+                'anonymous': {},
+                'user': {'Authorization': f'Token {token.key}'},
+            }
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        return {'anonymous': APIClient(), 'user': client}
+
+    def request(self, client, url):
+        if self.options['cold']:
+            cache.clear()
+        response = client.get(url)
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+        if response.status_code != 200:
+            raise CommandError(f'{url}: ответ {response.status_code}')
+
+    def measure(self, client, url):
+        for _ in range(self.options['warmup']):
+            self.request(client, url)
+        timings, queries = [], []
+        for _ in range(self.options['requests']):
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                self.request(client, url)
+                timings.append(time.perf_counter() - start)
+            queries.append(len(context))
+        peaks = []
+        for _ in range(min(5, self.options['requests'])):
+            tracemalloc.start()
+            self.request(client, url)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        return {
+            'p50_ms': round(percentile(timings, 0.5) * 1000, 2),
+            'p95_ms': round(percentile(timings, 0.95) * 1000, 2),
+            'queries': max(queries),
+            'memory_kb': round(max(peaks) / 1024, 1),
+        }
+
+    def fetch(self, headers, url):
+        request = Request(
+            self.options['base_url'].rstrip('/') + quote(url, safe='/?&=,'),
+            headers=headers
+        )
+        start = time.perf_counter()
+        try:
+            with urlopen(request, timeout=60) as response:
+                response.read()
+        except URLError as error:
+            raise CommandError(f'{url}: {error}')
+        return time.perf_counter() - start
+
+    def measure_http(self, headers, url):
+        """ Задержки и пропускная способность сервера при
+            --concurrency одновременных запросах. SQL и память
+            процесса сервера отсюда не видны. """
+        fetch = partial(self.fetch, headers)
+        with ThreadPoolExecutor(self.options['concurrency']) as executor:
+            list(executor.map(fetch, [url] * self.options['warmup']))
+            start = time.perf_counter()
+            timings = list(
+                executor.map(fetch, [url] * self.options['requests'])
+            )
+            elapsed = time.perf_counter() - start
+        return {
+            'p50_ms': round(percentile(timings, 0.5) * 1000, 2),
+            'p95_ms': round(percentile(timings, 0.95) * 1000, 2),
+            'rps': round(len(timings) / elapsed, 1),
+        }
+
+    def compare(self, results, baseline):
+        regressions = []
+        for name, result in results.items():
+            base = baseline.get(name)
+            if base is None:
+                continue
+            tolerance = 1 + self.options['tolerance']
+            if result.get('queries', 0) > base.get('queries', 0):
+                regressions.append(
+                    f'{name}: запросов {base["queries"]} → '
+                    f'{result["queries"]}'
+                )
+            for field in ('p95_ms', 'memory_kb'):
+                if field not in result or field not in base:
+                    continue
+                if result[field] > base[field] * tolerance:
+                    regressions.append(
+                        f'{name}: {field} {base[field]} → {result[field]}'
+                    )
+        return regressions
+
+    def handle(self, *args, **options):
+        self.options = options
+        setup_test_environment()
+        logging.getLogger('api.requests').disabled = True
+        user = self.get_user(options['user'])
+        clients = self.get_clients(user)
+        recipe = Recipe.objects.order_by('-pub_date', '-id').first()
+        ingredient = Ingredient.objects.order_by('pk').first()
+        if recipe is None or ingredient is None:
+            raise CommandError('Нет данных: выполните generate_data')
+        params = {
+            'recipe': recipe.pk,
+            'search': recipe.name.split()[-1],
+            'prefix': ingredient.name[:2],
+            'ingredient': ingredient.pk,
+        }
+        results = {}
+        if options['base_url']:
+            measure, columns = self.measure_http, (('rps', 'запр/с'),)
+        else:
+            measure, columns = self.measure, (
+                ('queries', 'SQL'), ('memory_kb', 'память КБ'),
+            )
+        self.stdout.write(
+            f'{"эндпоинт":<25}{"p50 мс":>10}{"p95 мс":>10}'
+            + ''.join(f'{title:>12}' for _, title in columns)
+        )
+        for name in options['endpoints']:
+            client, url = ENDPOINTS[name]
+            result = measure(clients[client], url.format(**params))
+            results[name] = result
+            self.stdout.write(
+                f'{name:<25}{result["p50_ms"]:>10}{result["p95_ms"]:>10}'
+                + ''.join(f'{result[field]:>12}' for field, _ in columns)
+            )
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as baseline_file:
+                json.dump(results, baseline_file, indent=2)
+            self.stdout.write(self.style.SUCCESS('База сохранена'))
+        if options['baseline']:
+            with open(options['baseline']) as baseline_file:
+                regressions = self.compare(results, json.load(baseline_file))
+            if regressions:
+                raise CommandError('\n'.join(['Регрессии:'] + regressions))
+            self.stdout.write(self.style.SUCCESS('Регрессий нет'))
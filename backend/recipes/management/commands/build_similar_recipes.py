@@ -0,0 +1,83 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from recipes.models import Recipe, RecipeNeighbour
+from recipes.similarity import METRICS, IngredientMatrix, store_neighbours
+
+
+class Command(BaseCommand):
+    help = ' Посчитать похожие рецепты по общим ингредиентам '
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Пересчитать все рецепты, а не только изменённые',
+        )
+        parser.add_argument('--metric', choices=METRICS, default='cosine')
+        parser.add_argument(
+            '--top-k', type=int, default=settings.SIMILAR_RECIPES_COUNT,
+            help='Сколько соседей хранить для рецепта',
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='Сколько рецептов считать одним матричным произведением',
+        )
+        parser.add_argument(
+            '--max-share', type=float, default=0.5,
+            help='Ингредиенты чаще этой доли рецептов не дают кандидатов',
+        )
+
+    def refresh(self, recipe_ids):
+        """ Пересчитать соседей рецептов; вернуть id новых соседей. """
+        rows = self.matrix.get_rows(recipe_ids)
+        found = set()
+        recipe_ids = sorted(recipe_ids)
+        chunk_size = self.options['chunk_size']
+        for start in range(0, len(rows), chunk_size):
+            neighbours = self.matrix.neighbours(
+                rows[start:start + chunk_size], self.options['top_k'],
+                self.options['metric']
+            )
+            found.update(neighbours[1].tolist())
+            with transaction.atomic():
+                store_neighbours(
+                    self.matrix.recipe_ids[
+                        rows[start:start + chunk_size]
+                    ].tolist(),
+                    neighbours
+                )
+        for start in range(0, len(recipe_ids), chunk_size):
+            Recipe.objects.filter(
+                id__in=recipe_ids[start:start + chunk_size]
+            ).update(similar_updated=self.started)
+        return found
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.started = timezone.now()
+        self.stdout.write(self.style.WARNING('Старт команды'))
+        self.matrix = IngredientMatrix(options['max_share'])
+        recipes = Recipe.objects.all()
+        if not options['full']:
+            recipes = recipes.filter(
+                Q(similar_updated__isnull=True)
+                | Q(modified__gt=F('similar_updated'))
+            )
+        changed = set(recipes.values_list('id', flat=True))
+        # Рецепты, у которых изменённые были в соседях, тоже пересчитываются.
+        affected = set()
+        listed = sorted(changed)
+        for start in range(0, len(listed), options['chunk_size']):
+            affected.update(RecipeNeighbour.objects.filter(
+                similar__in=listed[start:start + options['chunk_size']]
+            ).values_list('recipe_id', flat=True))
+        affected |= self.refresh(changed)
+        affected -= changed
+        self.refresh(affected)
+        self.stdout.write(
+            f'Пересчитано рецептов: {len(changed) + len(affected)}'
+        )
+        self.stdout.write(self.style.SUCCESS('Похожие рецепты посчитаны'))
@@ -0,0 +1,218 @@
+import logging
+import random
+import tempfile
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import (CaptureQueriesContext, override_settings,
+                               setup_test_environment)
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from recipes import feed
+from recipes.factories import bulk_create_ids, create_recipes, create_users
+from recipes.models import (Favorite, Ingredient, ShoppingCart,
+                            ShoppingListItem, Tag)
+from users.models import Follow
+
+IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABAgMAAABieywaAAAA'
+    'CVBMVEUAAAD///9fX1/S0ecCAAAACXBIWXMAAA7EAAAOxAGVKw4bAAAACklEQVQImWNoAA'
+    'AAggCByxOyYQAAAABJRU5ErkJggg=='
+)
+
+# Наибольшее допустимое число SQL-запросов на запрос к эндпоинту
+# при пустом кеше. Учитываются поиск токена и точки сохранения:
+# прогон идёт внутри транзакции, которая затем откатывается.
+BUDGETS = {
+    'recipes_anonymous': 4,
+    'recipes': 9,
+    'recipe_detail': 5,
+    'recipe_create': 18,
+    'recipe_update': 20,
+    'favorite_add': 6,
+    'favorite_remove': 4,
+    'shopping_cart_add': 14,
+    'shopping_cart_remove': 12,
+    'download_shopping_cart': 2,
+    'feed': 9,
+    'users': 3,
+    'subscriptions': 4,
+    'subscribe': 9,
+    'unsubscribe': 6,
+    'tags': 1,
+    'ingredients': 1,
+}
+
+
+class Command(BaseCommand):
+    help = ' Проверить бюджеты SQL-запросов эндпоинтов на 1 и N объектах '
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--size', type=int, default=10,
+            help='Сколько связанных объектов создавать во втором прогоне',
+        )
+
+    @staticmethod
+    def create_fixtures(size):
+        """ Данные прогона: size авторов с рецептами, все рецепты
+            в избранном и корзине пользователя, подписки на всех авторов. """
+        rng = random.Random(size)
+        tags = bulk_create_ids(Tag, [
+            Tag(name=f'budget-{size}-{number}',
+                color=f'#{0xB0D000 + size * 100 + number:06X}',
+                slug=f'budget-{size}-{number}')
+            for number in range(size)
+        ], size)
+        ingredients = bulk_create_ids(Ingredient, [
+            Ingredient(name=f'budget-{size}-{number}', measurement_unit='г')
+            for number in range(size)
+        ], size)
+        user, *authors = create_users(rng, size + 2, f'budget{size}_')
+        free_author = authors.pop()
+        recipes = create_recipes(rng, size, authors, tags, ingredients,
+                                 ingredients_per_recipe=size,
+                                 tags_per_recipe=size)
+        for model in (Favorite, ShoppingCart):
+            model.objects.bulk_create(
+                model(user_id=user, recipe_id=recipe) for recipe in recipes
+            )
+        Follow.objects.bulk_create(
+            Follow(user_id=user, author_id=author) for author in authors
+        )
+        ShoppingListItem.objects.refresh([user])
+        feed.rebuild(authors)
+        return {
+            'user': user, 'author': free_author, 'recipe': recipes[0],
+            'tags': tags, 'ingredients': ingredients,
+        }
+
+    @staticmethod
+    def get_scenarios(fixtures):
+        size = len(fixtures['tags'])
+        payload = {
+            'tags': fixtures['tags'],
+            'ingredients': [
+                {'id': ingredient, 'amount': 10}
+                for ingredient in fixtures['ingredients']
+            ],
+            'name': 'Бюджет', 'text': 'Проверка', 'cooking_time': 10,
+            'image': IMAGE,
+        }
+        update = {
+            **payload,
+            'ingredients': [
+                {'id': ingredient, 'amount': 20}
+                for ingredient in fixtures['ingredients']
+            ],
+        }
+        recipe, author = fixtures['recipe'], fixtures['author']
+        return (
+            ('recipes_anonymous', 'anonymous', 'get',
+             f'/api/recipes/?limit={size}', None, 200),
+            ('recipes', 'user', 'get',
+             f'/api/recipes/?limit={size}', None, 200),
+            ('recipe_detail', 'user', 'get',
+             f'/api/recipes/{recipe}/', None, 200),
+            ('recipe_create', 'user', 'post',
+             '/api/recipes/', payload, 201),
+            ('recipe_update', 'user', 'patch',
+             '/api/recipes/{created}/', update, 200),
+            ('favorite_add', 'user', 'post',
+             '/api/recipes/{created}/favorite/', None, 201),
+            ('favorite_remove', 'user', 'delete',
+             '/api/recipes/{created}/favorite/', None, 204),
+            ('shopping_cart_add', 'user', 'post',
+             '/api/recipes/{created}/shopping_cart/', None, 201),
+            ('shopping_cart_remove', 'user', 'delete',
+             '/api/recipes/{created}/shopping_cart/', None, 204),
+            ('download_shopping_cart', 'user', 'get',
+             '/api/recipes/download_shopping_cart/', None, 200),
+            ('feed', 'user', 'get',
+             f'/api/recipes/feed/?limit={size}', None, 200),
+            ('users', 'user', 'get', f'/api/users/?limit={size}', None, 200),
+            ('subscriptions', 'user', 'get',
+             f'/api/users/subscriptions/?limit={size}&recipes_limit=3',
+             None, 200),
+            ('subscribe', 'user', 'post',
+             f'/api/users/{author}/subscribe/', None, 201),
+            ('unsubscribe', 'user', 'delete',
+             f'/api/users/{author}/subscribe/', None, 204),
+            ('tags', 'anonymous', 'get', '/api/tags/', None, 200),
+            ('ingredients', 'anonymous', 'get', '/api/ingredients/',
+             None, 200),
+        )
+
+    def run(self, size, measure=None):
+        """ Число запросов каждого сценария; данные откатываются.
+            measure(name) — контекст подсчёта запросов сценария,
+            по умолчанию CaptureQueriesContext. """
+        counts, errors = {}, []
+        with transaction.atomic():
+            fixtures = self.create_fixtures(size)
+            token = Token.objects.create(user_id=fixtures['user'])
+            clients = {'anonymous': APIClient(), 'user': APIClient()}
+            clients['user'].credentials(
+                HTTP_AUTHORIZATION=f'Token {token.key}'
+            )
+            created = None
+            for name, client, method, url, data, expected in (
+                self.get_scenarios(fixtures)
+            ):
+                cache.clear()
+                with (measure(name) if measure
+                      else CaptureQueriesContext(connection)) as context:
+                    response = getattr(clients[client], method)(
+                        url.format(created=created), data, format='json'
+                    )
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                counts[name] = len(context)
+                if response.status_code != expected:
+                    errors.append(
+                        f'{name} ({size}): ответ {response.status_code}, '
+                        f'ожидался {expected}'
+                    )
+                if name == 'recipe_create' and expected == 201:
+                    created = response.data.get('id')
+            transaction.set_rollback(True)
+        return counts, errors
+
+    def handle(self, *args, **options):
+        size = options['size']
+        if size < 2:
+            raise CommandError('--size должен быть больше 1')
+        setup_test_environment()
+        logging.getLogger('api.requests').disabled = True
+        with tempfile.TemporaryDirectory() as media, override_settings(
+            CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'query-budgets',
+            }},
+            MEDIA_ROOT=media,
+        ):
+            single, errors = self.run(1)
+            many, many_errors = self.run(size)
+        errors += many_errors
+        self.stdout.write(
+            f'{"эндпоинт":<25}{"бюджет":>8}{"1":>6}{size:>6}'
+        )
+        for name, budget in BUDGETS.items():
+            self.stdout.write(
+                f'{name:<25}{budget:>8}{single[name]:>6}{many[name]:>6}'
+            )
+            if max(single[name], many[name]) > budget:
+                errors.append(
+                    f'{name}: {max(single[name], many[name])} запросов '
+                    f'при бюджете {budget}'
+                )
+            if many[name] != single[name]:
+                errors.append(
+                    f'{name}: запросов {single[name]} на 1 объекте '
+                    f'и {many[name]} на {size}'
+                )
+        if errors:
+            raise CommandError('\n'.join(errors))
+        self.stdout.write(self.style.SUCCESS('Бюджеты соблюдены'))
@@ -0,0 +1,81 @@
+import random
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.factories import create_pairs, create_recipes, create_users
+from recipes.models import Favorite, Ingredient, ShoppingCart, Tag
+from recipes.versions import bump_version
+from users.models import Follow, User
+
+
+class Command(BaseCommand):
+    help = ' Сгенерировать воспроизводимый набор данных для нагрузки '
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument('--favorites', type=int, default=50000)
+        parser.add_argument('--follows', type=int, default=20000)
+        parser.add_argument('--shopping-carts', type=int, default=20000)
+        parser.add_argument(
+            '--ingredients-per-recipe', type=int, default=8,
+            help='Среднее число ингредиентов в рецепте',
+        )
+        parser.add_argument(
+            '--tags-per-recipe', type=int, default=2,
+            help='Наибольшее число тегов у рецепта',
+        )
+        parser.add_argument(
+            '--seed', type=int, default=1,
+            help='Зерно генератора; одно зерно даёт одни и те же данные',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=2000,
+            help='Сколько строк вставлять за один запрос',
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+        prefix = f'gen{options["seed"]}_'
+        if User.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(
+                f'Данные с зерном {options["seed"]} уже созданы'
+            )
+        tags = list(Tag.objects.order_by('pk').values_list('pk', flat=True))
+        ingredients = list(Ingredient.objects.order_by('pk').values_list(
+            'pk', flat=True
+        ))
+        if not tags or not ingredients:
+            raise CommandError(
+                'Сначала загрузите ингредиенты и теги командой load_data'
+            )
+        self.stdout.write(self.style.WARNING('Старт команды'))
+        users = create_users(rng, options['users'], prefix, batch_size)
+        self.stdout.write(f'Пользователи: {len(users)}')
+        recipes = create_recipes(
+            rng, options['recipes'], users, tags, ingredients,
+            options['ingredients_per_recipe'], options['tags_per_recipe'],
+            batch_size,
+        )
+        self.stdout.write(f'Рецепты: {len(recipes)}')
+        for model, fields, targets, count in (
+            (Favorite, ('user_id', 'recipe_id'), recipes,
+             options['favorites']),
+            (ShoppingCart, ('user_id', 'recipe_id'), recipes,
+             options['shopping_carts']),
+            (Follow, ('user_id', 'author_id'), users, options['follows']),
+        ):
+            create_pairs(rng, model, fields, users, targets, count,
+                         batch_size=batch_size)
+            self.stdout.write(
+                f'{model._meta.verbose_name_plural}: '
+                f'{model.objects.count()}'
+            )
+        call_command('reconcile_counters', stdout=self.stdout)
+        call_command('rebuild_shopping_lists', stdout=self.stdout)
+        call_command('rebuild_feeds', stdout=self.stdout)
+        for name in ('recipes', 'recipe_fragments', 'recipe_ingredients'):
+            bump_version(name)
+        self.stdout.write(self.style.SUCCESS('Данные сгенерированы'))
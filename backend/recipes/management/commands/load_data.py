@@ -1,25 +1,131 @@
+import csv
 import json
+import os
+import re
+from functools import partial
+from itertools import islice
 
-from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 
 from recipes.models import Ingredient, Tag
+from recipes.versions import bump_version_on_commit
+
+SEPARATORS = re.compile(r'[\s,]*')
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_json_array(data_file):
+    """ Читать JSON-массив объектов по частям, не загружая файл целиком. """
+    decoder = json.JSONDecoder()
+    buffer, position, opened = '', 0, False
+    for chunk in iter(partial(data_file.read, CHUNK_SIZE), ''):
+        buffer, position = buffer[position:] + chunk, 0
+        while True:
+            position = SEPARATORS.match(buffer, position).end()
+            if position == len(buffer):
+                break
+            if not opened:
+                if buffer[position] != '[':
+                    raise CommandError('Ожидался JSON-массив')
+                opened, position = True, position + 1
+                continue
+            if buffer[position] == ']':
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                break
+            yield item
+    raise CommandError('Неожиданный конец JSON-файла')
+
+
+def iter_csv(data_file, fieldnames):
+    """ Читать CSV без заголовка или с заголовком из имён полей. """
+    for row in csv.DictReader(data_file, fieldnames=fieldnames):
+        if tuple(row.values()) == tuple(fieldnames):
+            continue
+        yield row
 
 
 class Command(BaseCommand):
     help = ' Загрузить данные в модель ингредиентов '
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ingredients',
+            default=os.path.join(settings.BASE_DIR, 'data/ingredients.json'),
+            help='Файл ингредиентов в формате JSON или CSV',
+        )
+        parser.add_argument(
+            '--tags',
+            default=os.path.join(settings.BASE_DIR, 'data/tags.json'),
+            help='Файл тегов в формате JSON или CSV',
+        )
+        parser.add_argument(
+            '--format', choices=('json', 'csv'),
+            help='Формат файлов, по умолчанию по расширению',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Сколько строк вставлять за один запрос',
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Проверить загрузку и откатить транзакцию',
+        )
+        parser.add_argument(
+            '--progress', action='store_true',
+            help='Показывать количество обработанных строк',
+        )
+
+    def read(self, path, fieldnames):
+        data_format = self.options['format'] or (
+            'csv' if path.lower().endswith('.csv') else 'json'
+        )
+        with open(path, encoding='utf-8', newline='') as data_file:
+            if data_format == 'csv':
+                yield from iter_csv(data_file, fieldnames)
+            else:
+                yield from iter_json_array(data_file)
+
+    def load(self, model, path, fieldnames):
+        rows = self.read(path, fieldnames)
+        before = model.objects.count()
+        processed = 0
+        while True:
+            batch = list(islice(rows, self.options['batch_size']))
+            if not batch:
+                break
+            model.objects.bulk_create(
+                (model(**{field: row[field] for field in fieldnames})
+                 for row in batch),
+                ignore_conflicts=True,
+            )
+            processed += len(batch)
+            if self.options['progress']:
+                self.stdout.write(
+                    f'{model._meta.verbose_name_plural}: {processed}'
+                )
+        created = model.objects.count() - before
+        self.stdout.write(
+            f'{model._meta.verbose_name_plural}: прочитано {processed}, '
+            f'добавлено {created}'
+        )
+
     def handle(self, *args, **options):
+        self.options = options
         self.stdout.write(self.style.WARNING('Старт команды'))
-        with open('data/ingredients.json', encoding='utf-8',
-                  ) as data_file_ingredients:
-            ingredient_data = json.loads(data_file_ingredients.read())
-            for ingredients in ingredient_data:
-                Ingredient.objects.get_or_create(**ingredients)
-
-        with open('data/tags.json', encoding='utf-8',
-                  ) as data_file_tags:
-            tags_data = json.loads(data_file_tags.read())
-            for tags in tags_data:
-                Tag.objects.get_or_create(**tags)
-
+        with transaction.atomic():
+            self.load(
+                Ingredient, options['ingredients'],
+                ('name', 'measurement_unit')
+            )
+            self.load(Tag, options['tags'], ('name', 'color', 'slug'))
+            if options['dry_run']:
+                transaction.set_rollback(True)
+                self.stdout.write(self.style.SUCCESS('Изменения отменены'))
+                return
+            bump_version_on_commit('ingredients', 'tags')
         self.stdout.write(self.style.SUCCESS('Данные загружены'))
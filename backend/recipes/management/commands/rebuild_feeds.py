@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from recipes import feed
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = ' Пересобрать ленты подписок из недавних рецептов авторов '
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Сколько авторов обрабатывать за раз',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.WARNING('Старт команды'))
+        authors = User.objects.filter(
+            followers_count__gt=0, recipes_count__gt=0
+        ).order_by('pk').values_list('pk', flat=True)
+        last_pk = 0
+        while True:
+            batch = list(authors.filter(
+                pk__gt=last_pk
+            )[:options['batch_size']])
+            if not batch:
+                break
+            last_pk = batch[-1]
+            feed.rebuild(batch)
+        self.stdout.write(self.style.SUCCESS('Ленты пересобраны'))
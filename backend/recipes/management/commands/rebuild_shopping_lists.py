@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Sum
+
+from recipes.models import IngredientRecipe, ShoppingListItem
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = ' Пересобрать и проверить сводные списки покупок '
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Только сравнить сводные списки с корзинами',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Сколько пользователей обрабатывать за раз',
+        )
+
+    @staticmethod
+    def get_expected(users):
+        return {
+            (total['recipe__shopping_list__user'], total['ingredient']):
+            total['total_amount']
+            for total in IngredientRecipe.objects.filter(
+                recipe__shopping_list__user__in=users
+            ).order_by().values(
+                'recipe__shopping_list__user', 'ingredient'
+            ).annotate(total_amount=Sum('amount'))
+        }
+
+    @staticmethod
+    def get_actual(users):
+        return {
+            (user, ingredient): total_amount
+            for user, ingredient, total_amount
+            in ShoppingListItem.objects.filter(user__in=users).values_list(
+                'user', 'ingredient', 'total_amount'
+            )
+        }
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.WARNING('Старт команды'))
+        user_ids = list(
+            User.objects.order_by('pk').values_list('pk', flat=True)
+        )
+        batch_size = options['batch_size']
+        mismatches = 0
+        for start in range(0, len(user_ids), batch_size):
+            users = user_ids[start:start + batch_size]
+            if options['verify']:
+                expected = self.get_expected(users)
+                actual = self.get_actual(users)
+                mismatches += sum(
+                    expected.get(key) != actual.get(key)
+                    for key in expected.keys() | actual.keys()
+                )
+            else:
+                ShoppingListItem.objects.refresh(users)
+        if mismatches:
+            raise CommandError(f'Расхождений в списках покупок: {mismatches}')
+        self.stdout.write(self.style.SUCCESS(
+            'Расхождений не найдено' if options['verify']
+            else 'Списки покупок пересобраны'
+        ))
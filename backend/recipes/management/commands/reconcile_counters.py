@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.signals import COUNTERS
+
+
+class Command(BaseCommand):
+    help = ' Исправить расхождения в счётчиках избранного и подписок '
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Сколько строк проверять за раз',
+        )
+
+    @staticmethod
+    def get_actual(sender, key):
+        field = key[:-len('_id')]
+        return Coalesce(Subquery(
+            sender.objects.filter(**{field: OuterRef('pk')}).order_by(
+            ).values(field).annotate(total=Count('pk')).values('total')
+        ), 0)
+
+    def reconcile(self, sender, target, key, field, batch_size):
+        repaired = 0
+        last_pk = 0
+        while True:
+            batch = list(target.objects.filter(pk__gt=last_pk).order_by(
+                'pk').values_list('pk', flat=True)[:batch_size])
+            if not batch:
+                return repaired
+            last_pk = batch[-1]
+            drifted = list(target.objects.filter(pk__in=batch).annotate(
+                actual=self.get_actual(sender, key)
+            ).exclude(**{field: F('actual')}).values_list('pk', flat=True))
+            if drifted:
+                repaired += target.objects.filter(pk__in=drifted).update(
+                    **{field: self.get_actual(sender, key)}
+                )
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.WARNING('Старт команды'))
+        for sender, target, key, field in COUNTERS:
+            repaired = self.reconcile(
+                sender, target, key, field, options['batch_size']
+            )
+            self.stdout.write(
+                f'{target._meta.model_name}.{field}: исправлено {repaired}'
+            )
+        self.stdout.write(self.style.SUCCESS('Счётчики сверены'))
@@ -0,0 +1,54 @@
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand, CommandError
+
+from api.metrics import endpoint_stats
+
+
+class Command(BaseCommand):
+    help = ' Показать сводку времени и SQL-запросов по эндпоинтам '
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sort', default='total_us',
+            choices=('total_us', 'db_us', 'queries', 'requests',
+                     'n_plus_one'),
+            help='Поле сортировки, по убыванию',
+        )
+        parser.add_argument(
+            '--reset', action='store_true',
+            help='Обнулить сводку после вывода',
+        )
+
+    def handle(self, *args, **options):
+        if isinstance(caches[DEFAULT_CACHE_ALIAS], LocMemCache):
+            raise CommandError(
+                'Сводку воркеры копят в общем кеше, а кеш по умолчанию '
+                'локальный для процесса: задайте CACHE_BACKEND и '
+                'CACHE_LOCATION общего кеша, например memcached'
+            )
+        stats = endpoint_stats.get()
+        if not stats:
+            self.stdout.write(self.style.WARNING('Сводка пуста'))
+            return
+        self.stdout.write(
+            f'{"эндпоинт":<45}{"запросов":>9}{"мс":>9}{"БД мс":>9}'
+            f'{"сер. мс":>9}{"SQL":>7}{"N+1":>6}'
+        )
+        for endpoint, values in sorted(
+            stats.items(),
+            key=lambda item: item[1][options['sort']],
+            reverse=True,
+        ):
+            requests = values['requests'] or 1
+            self.stdout.write(
+                f'{endpoint:<45}{values["requests"]:>9}'
+                f'{values["total_us"] / requests / 1000:>9.1f}'
+                f'{values["db_us"] / requests / 1000:>9.1f}'
+                f'{values["serializer_us"] / requests / 1000:>9.1f}'
+                f'{values["queries"] / requests:>7.1f}'
+                f'{values["n_plus_one"]:>6}'
+            )
+        if options['reset']:
+            endpoint_stats.reset()
+            self.stdout.write(self.style.SUCCESS('Сводка обнулена'))
@@ -1,11 +1,12 @@
 from colorfield.fields import ColorField
 from django.conf import settings
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import (MaxValueValidator, MinValueValidator,
                                     RegexValidator)
-from django.db import models
-from django.db.models import UniqueConstraint
+from django.db import models, transaction
+from django.db.models import Sum, UniqueConstraint
 
-from users.models import User
+from users.models import DerivedFieldsMixin, User
 
 
 class Ingredient(models.Model):
@@ -69,8 +70,12 @@ class Tag(models.Model):
         return self.name
 
 
-class Recipe(models.Model):
+class Recipe(DerivedFieldsMixin, models.Model):
     """ Модель рецептов. """
+    derived_fields = (
+        'image_variants', 'similar_updated', 'favorites_count',
+        'shopping_cart_count', 'search_vector',
+    )
     author = models.ForeignKey(
         User,
         verbose_name='Автор рецепта',
@@ -85,6 +90,11 @@ class Recipe(models.Model):
         upload_to='recipes/image/',
         verbose_name='Изображение'
     )
+    image_variants = models.JSONField(
+        verbose_name='Уменьшенные копии изображения',
+        default=dict,
+        editable=False
+    )
     text = models.TextField(verbose_name='Описание')
     ingredients = models.ManyToManyField(
         Ingredient,
@@ -107,9 +117,44 @@ class Recipe(models.Model):
         verbose_name='Дата публикации',
         auto_now_add=True
     )
+    modified = models.DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True,
+        db_index=True
+    )
+    similar_updated = models.DateTimeField(
+        verbose_name='Похожие рецепты пересчитаны',
+        null=True,
+        editable=False
+    )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='В избранном',
+        default=0,
+        editable=False
+    )
+    shopping_cart_count = models.PositiveIntegerField(
+        verbose_name='В списках покупок',
+        default=0,
+        editable=False
+    )
+    search_vector = SearchVectorField(
+        verbose_name='Поисковый вектор',
+        null=True,
+        editable=False
+    )
 
     class Meta:
-        ordering = ('-pub_date',)
+        ordering = ('-pub_date', '-id')
+        indexes = [
+            models.Index(
+                fields=('-pub_date', '-id'),
+                name='recipe_pub_date_id_idx'
+            ),
+            models.Index(
+                fields=('author', '-pub_date', '-id'),
+                name='recipe_author_pub_date_idx'
+            ),
+        ]
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
 
@@ -190,3 +235,142 @@ class IngredientRecipe(models.Model):
             f'{self.ingredient.name} :: {self.ingredient.measurement_unit}'
             f' - {self.amount} '
         )
+
+
+class ShoppingListItemManager(models.Manager):
+    """ Пересчёт сводного списка покупок. """
+
+    def refresh(self, users, ingredients=None):
+        """ Пересчитать строки списка покупок пользователей.
+            Если переданы ингредиенты, пересчитываются только они.
+            Строки пользователей блокируются по возрастанию pk; строки
+            затронутых рецептов вызывающий код блокирует до этого. """
+        items = self.filter(user__in=users)
+        totals = IngredientRecipe.objects.filter(
+            recipe__shopping_list__user__in=users
+        )
+        if ingredients is not None:
+            items = items.filter(ingredient__in=ingredients)
+            totals = totals.filter(ingredient__in=ingredients)
+        with transaction.atomic():
+            list(User.objects.select_for_update().filter(
+                pk__in=users
+            ).order_by('pk').values_list('pk'))
+            items.delete()
+            self.bulk_create(
+                self.model(
+                    user_id=total['recipe__shopping_list__user'],
+                    ingredient_id=total['ingredient'],
+                    total_amount=total['total_amount'],
+                )
+                for total in totals.order_by().values(
+                    'recipe__shopping_list__user', 'ingredient'
+                ).annotate(total_amount=Sum('amount'))
+            )
+
+
+class ShoppingListItem(models.Model):
+    """ Сводный список покупок пользователя. """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь',
+        related_name='shopping_list_items'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент'
+    )
+    total_amount = models.PositiveIntegerField(
+        verbose_name='Общее количество'
+    )
+
+    objects = ShoppingListItemManager()
+
+    class Meta:
+        verbose_name = 'Строка списка покупок'
+        verbose_name_plural = 'Сводный список покупок'
+        constraints = [
+            UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='unique_shopping_list_item'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user} :: {self.ingredient} - {self.total_amount}'
+
+
+class FeedEntry(models.Model):
+    """ Рецепт в ленте подписчика. Дата публикации продублирована
+        для чтения ленты по индексу (user, pub_date, recipe). """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Подписчик',
+        related_name='feed_entries'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        verbose_name='Рецепт',
+        related_name='feed_entries'
+    )
+    pub_date = models.DateTimeField(verbose_name='Дата публикации')
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Ленты подписок'
+        constraints = [
+            UniqueConstraint(
+                fields=('user', 'recipe'),
+                name='unique_feed_entry'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=('user', '-pub_date', '-recipe'),
+                name='feed_user_pub_date_idx'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user} :: {self.recipe}'
+
+
+class RecipeNeighbour(models.Model):
+    """ Похожий рецепт по общим ингредиентам, считается заранее
+        командой build_similar_recipes. """
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        verbose_name='Рецепт',
+        related_name='neighbours'
+    )
+    similar = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        verbose_name='Похожий рецепт',
+        related_name='+'
+    )
+    score = models.FloatField(verbose_name='Сходство')
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        constraints = [
+            UniqueConstraint(
+                fields=('recipe', 'similar'),
+                name='unique_recipe_neighbour'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=('recipe', '-score'),
+                name='neighbour_recipe_score_idx'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.recipe} ~ {self.similar}: {self.score:.2f}'
@@ -0,0 +1,341 @@
+import json
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from functools import partial, reduce
+from itertools import chain
+
+import numpy as np
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models import F, Q
+
+from foodgram.db_router import primary_reads
+
+from .models import Ingredient, IngredientRecipe, Recipe
+from .versions import get_version
+
+SEARCH_CONFIG = 'russian'
+
+POSTGRESQL_SEARCH_SQL = (
+    '''
+    CREATE OR REPLACE FUNCTION recipes_recipe_search_vector_update()
+    RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('{config}', coalesce(NEW.name, '')), 'A')
+            || setweight(to_tsvector('{config}', coalesce(NEW.text, '')), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    '''.format(config=SEARCH_CONFIG),
+    'DROP TRIGGER IF EXISTS recipes_recipe_search_vector_trigger '
+    'ON recipes_recipe',
+    'CREATE TRIGGER recipes_recipe_search_vector_trigger '
+    'BEFORE INSERT OR UPDATE OF name, text ON recipes_recipe '
+    'FOR EACH ROW EXECUTE PROCEDURE recipes_recipe_search_vector_update()',
+    'CREATE INDEX IF NOT EXISTS recipes_recipe_search_vector_idx '
+    'ON recipes_recipe USING gin (search_vector)',
+    'UPDATE recipes_recipe SET name = name WHERE search_vector IS NULL',
+)
+
+SQLITE_SEARCH_SQL = (
+    'CREATE VIRTUAL TABLE IF NOT EXISTS recipes_recipe_fts USING fts5('
+    'name, text, content=recipes_recipe, content_rowid=id)',
+    'CREATE TRIGGER IF NOT EXISTS recipes_recipe_fts_insert '
+    'AFTER INSERT ON recipes_recipe BEGIN '
+    'INSERT INTO recipes_recipe_fts(rowid, name, text) '
+    'VALUES (new.id, new.name, new.text); END',
+    'CREATE TRIGGER IF NOT EXISTS recipes_recipe_fts_delete '
+    'AFTER DELETE ON recipes_recipe BEGIN '
+    "INSERT INTO recipes_recipe_fts(recipes_recipe_fts, rowid, name, text) "
+    "VALUES ('delete', old.id, old.name, old.text); END",
+    'CREATE TRIGGER IF NOT EXISTS recipes_recipe_fts_update '
+    'AFTER UPDATE OF name, text ON recipes_recipe BEGIN '
+    "INSERT INTO recipes_recipe_fts(recipes_recipe_fts, rowid, name, text) "
+    "VALUES ('delete', old.id, old.name, old.text); "
+    'INSERT INTO recipes_recipe_fts(rowid, name, text) '
+    'VALUES (new.id, new.name, new.text); END',
+    "INSERT INTO recipes_recipe_fts(recipes_recipe_fts) VALUES ('rebuild')",
+)
+
+RECIPE_INGREDIENTS_LOG = 'recipe_ingredients:log'
+RECIPE_INGREDIENTS_LOG_TIMEOUT = 24 * 60 * 60
+RECIPE_INGREDIENTS_GAP_TIMEOUT = 5
+EMPTY_IDS = np.empty(0, dtype=np.int64)
+
+SQLITE_RANK_SQL = '-bm25(recipes_recipe_fts, 10.0, 1.0)'
+SQLITE_MATCH_SQL = (
+    'recipes_recipe_fts MATCH %s',
+    'recipes_recipe_fts.rowid = recipes_recipe.id',
+)
+
+
+class IngredientIndex:
+    """ Индекс названий ингредиентов в памяти процесса.
+        Перестраивается при смене версии после изменения ингредиентов. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._index = ([], [])
+
+    def _build(self, version):
+        with primary_reads():
+            ingredients = sorted(
+                Ingredient.objects.all(),
+                key=lambda ingredient: (ingredient.name.lower(), ingredient.id)
+            )
+        names = [ingredient.name.lower() for ingredient in ingredients]
+        self._index = (names, ingredients)
+        self._version = version
+
+    def _refresh(self):
+        version = get_version('ingredients')
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._build(version)
+
+    def search(self, query):
+        """ Сначала совпадения по началу названия, затем по подстроке. """
+        self._refresh()
+        names, ingredients = self._index
+        query = query.strip().lower()
+        start = bisect_left(names, query)
+        end = bisect_right(names, query + chr(0x10FFFF), lo=start)
+        return ingredients[start:end] + [
+            ingredient for position, (name, ingredient)
+            in enumerate(zip(names, ingredients))
+            if query in name and not start <= position < end
+        ]
+
+
+ingredient_index = IngredientIndex()
+
+
+def find_positions(ids, values):
+    """ Позиции значений values, которые есть в отсортированном ids. """
+    positions = np.searchsorted(ids, values)
+    found = positions < len(ids)
+    found[found] = ids[positions[found]] == values[found]
+    return positions[found]
+
+
+def union(lists):
+    return np.unique(np.concatenate(lists)) if lists else EMPTY_IDS
+
+
+class RecipeIngredientIndex:
+    """ Инвертированный индекс ингредиент → отсортированный массив id
+        рецептов и число ингредиентов каждого рецепта.
+
+        Полностью перестраивается при смене версии 'recipe_ingredients'.
+        Правки отдельных рецептов публикуются в журнал в кеше, и каждый
+        процесс применяет их к своей копии без перестройки. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._position = 0
+        self._gap_since = None
+        self._index = ({}, np.zeros(1, dtype=np.int32))
+
+    def _build(self, version):
+        position = cache.get(RECIPE_INGREDIENTS_LOG, 0)
+        with primary_reads():
+            pairs = np.fromiter(chain.from_iterable(
+                IngredientRecipe.objects.order_by().values_list(
+                    'ingredient_id', 'recipe_id'
+                ).iterator(chunk_size=10000)
+            ), dtype=np.int64).reshape(-1, 2)
+        pairs = np.unique(pairs, axis=0)
+        ingredients, starts = np.unique(pairs[:, 0], return_index=True)
+        postings = dict(zip(
+            ingredients.tolist(), np.split(pairs[:, 1], starts[1:])
+        ))
+        sizes = np.bincount(pairs[:, 1]).astype(np.int32)
+        self._index = (postings, sizes)
+        self._version, self._position = version, position
+
+    def _apply(self, changes):
+        """ Заменить наборы ингредиентов рецептов из журнала. """
+        postings, sizes = self._index
+        postings = dict(postings)
+        recipes = np.array(sorted(changes), dtype=np.int64)
+        for ingredient, ids in postings.items():
+            positions = find_positions(ids, recipes)
+            if len(positions):
+                postings[ingredient] = np.delete(ids, positions)
+        added = {}
+        for recipe, ingredients in changes.items():
+            for ingredient in ingredients:
+                added.setdefault(ingredient, []).append(recipe)
+        for ingredient, ids in added.items():
+            postings[ingredient] = np.union1d(
+                postings.get(ingredient, EMPTY_IDS), ids
+            )
+        if recipes[-1] >= len(sizes):
+            sizes = np.concatenate((sizes, np.zeros(
+                recipes[-1] + 1 - len(sizes), dtype=np.int32
+            )))
+        else:
+            sizes = sizes.copy()
+        for recipe, ingredients in changes.items():
+            sizes[recipe] = len(set(ingredients))
+        self._index = (postings, sizes)
+
+    def _read_log(self, current):
+        keys = [
+            f'{RECIPE_INGREDIENTS_LOG}:{number}'
+            for number in range(self._position + 1, current + 1)
+        ]
+        entries = cache.get_many(keys)
+        for key in keys:
+            if key not in entries:
+                self._gap_since = self._gap_since or time.monotonic()
+                return (time.monotonic() - self._gap_since
+                        < RECIPE_INGREDIENTS_GAP_TIMEOUT)
+            self._apply(entries[key])
+            self._position += 1
+        self._gap_since = None
+        return True
+
+    def _refresh(self):
+        version = get_version('recipe_ingredients')
+        current = cache.get(RECIPE_INGREDIENTS_LOG, 0)
+        if version == self._version and current <= self._position:
+            return
+        with self._lock:
+            if version != self._version:
+                self._build(version)
+            elif not self._read_log(current):
+                # Запись журнала вытеснена из кеша: только перестройка.
+                self._build(version)
+
+    def match(self, include=(), exclude=(), any_match=False,
+              max_missing=None):
+        """ id рецептов по ингредиентам и признак исключения.
+
+            include — рецепт содержит все ингредиенты (any_match —
+            хотя бы один); с max_missing это продукты пользователя,
+            и рецепту может не хватать не больше max_missing других.
+            exclude — рецепт не содержит ни одного из ингредиентов.
+            Если задан только exclude, возвращаются id для исключения. """
+        if not include and not exclude:
+            return None, False
+        self._refresh()
+        postings, sizes = self._index
+        excluded = union([postings.get(pk, EMPTY_IDS) for pk in exclude])
+        if not include:
+            return excluded, True
+        lists = sorted(
+            (postings.get(pk, EMPTY_IDS) for pk in set(include)), key=len
+        )
+        if max_missing is not None:
+            ids, hits = np.unique(np.concatenate(lists), return_counts=True)
+            result = ids[sizes[ids] - hits <= max_missing]
+        elif any_match:
+            result = union(lists)
+        else:
+            result = reduce(
+                partial(np.intersect1d, assume_unique=True), lists
+            )
+        return np.setdiff1d(result, excluded, assume_unique=True), False
+
+
+recipe_ingredient_index = RecipeIngredientIndex()
+
+
+def publish_recipe_ingredients(changes):
+    """ После фиксации транзакции записать в журнал новые наборы
+        ингредиентов рецептов: {id рецепта: [id ингредиентов]}. """
+    changes = {
+        recipe: list(ingredients) for recipe, ingredients in changes.items()
+    }
+    if not changes:
+        return
+
+    def publish():
+        cache.add(RECIPE_INGREDIENTS_LOG, 0, None)
+        number = cache.incr(RECIPE_INGREDIENTS_LOG)
+        cache.set(f'{RECIPE_INGREDIENTS_LOG}:{number}', changes,
+                  RECIPE_INGREDIENTS_LOG_TIMEOUT)
+    transaction.on_commit(publish)
+
+
+def filter_recipe_ids(queryset, ids, exclude=False):
+    """ Отобрать или исключить рецепты по списку id одним параметром
+        запроса: массив в PostgreSQL, JSON в SQLite. """
+    ids = ids.tolist()
+    vendor = connections[queryset.db].vendor
+    if vendor == 'postgresql':
+        condition = ('"recipes_recipe"."id" <> ALL(%s)' if exclude
+                     else '"recipes_recipe"."id" = ANY(%s)')
+        params = [ids]
+    elif vendor == 'sqlite':
+        condition = '"recipes_recipe"."id" {} (SELECT value FROM {})'.format(
+            'NOT IN' if exclude else 'IN', 'json_each(%s)'
+        )
+        params = [json.dumps(ids)]
+    else:
+        method = queryset.exclude if exclude else queryset.filter
+        return method(id__in=ids)
+    return queryset.extra(where=[condition], params=params)
+
+
+def install_recipe_search(using='default', **kwargs):
+    """ Создать поисковый индекс рецептов после миграций:
+        tsvector с GIN-индексом в PostgreSQL, FTS5 в SQLite. """
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        statements = POSTGRESQL_SEARCH_SQL
+    elif connection.vendor == 'sqlite':
+        statements = SQLITE_SEARCH_SQL
+    else:
+        return
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def get_fts_query(query):
+    """ Запрос FTS5: все слова обязательны, каждое ищется как префикс. """
+    return ' '.join(
+        '"{}"*'.format(word.replace('"', '""')) for word in query.split()
+    )
+
+
+def search_recipes(queryset, query):
+    """ Полнотекстовый поиск по названию и описанию рецепта
+        с сортировкой по релевантности. """
+    query = query.strip()
+    vendor = connections[queryset.db].vendor
+    if not query:
+        return queryset
+    if vendor == 'postgresql':
+        search_query = SearchQuery(
+            query, config=SEARCH_CONFIG, search_type='websearch'
+        )
+        queryset = queryset.filter(search_vector=search_query).annotate(
+            search_rank=SearchRank(F('search_vector'), search_query)
+        )
+    elif vendor == 'sqlite':
+        fts_query = get_fts_query(query)
+        if not fts_query:
+            return queryset
+        # Соединение с FTS-таблицей: один MATCH на запрос, а не
+        # коррелированный подзапрос на каждую строку рецептов.
+        queryset = queryset.extra(
+            tables=['recipes_recipe_fts'],
+            where=SQLITE_MATCH_SQL,
+            params=(fts_query,),
+            select={'search_rank': SQLITE_RANK_SQL},
+        )
+    else:
+        return queryset.filter(Q(name__icontains=query)
+                               | Q(text__icontains=query))
+    return queryset.order_by(
+        '-search_rank', *Recipe._meta.ordering
+    )
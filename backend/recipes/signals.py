@@ -0,0 +1,108 @@
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from users.models import Follow, User
+
+from . import feed
+from .models import (Favorite, Ingredient, IngredientRecipe, Recipe,
+                     ShoppingCart, Tag)
+from .search import publish_recipe_ingredients
+from .versions import bump_version_on_commit, drop_recipe_fragments_on_commit
+
+USER_PUBLIC_FIELDS = {'email', 'username', 'first_name', 'last_name'}
+
+COUNTERS = (
+    (Favorite, Recipe, 'recipe_id', 'favorites_count'),
+    (ShoppingCart, Recipe, 'recipe_id', 'shopping_cart_count'),
+    (Recipe, User, 'author_id', 'recipes_count'),
+    (Follow, User, 'author_id', 'followers_count'),
+)
+
+
+def change_counter(model, pk, field, delta):
+    """ Атомарно изменить счётчик, не опуская его ниже нуля. """
+    queryset = model.objects.filter(pk=pk)
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+def counter_receivers(sender, target, key, field):
+    @receiver(post_save, sender=sender, weak=False)
+    def increment(instance, created, **kwargs):
+        if created:
+            change_counter(target, getattr(instance, key), field, 1)
+
+    @receiver(post_delete, sender=sender, weak=False)
+    def decrement(instance, **kwargs):
+        change_counter(target, getattr(instance, key), field, -1)
+
+
+for counter in COUNTERS:
+    counter_receivers(*counter)
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def ingredient_changed(**kwargs):
+    bump_version_on_commit(
+        'ingredients', 'recipes', 'recipe_fragments', 'recipe_ingredients'
+    )
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def tag_changed(**kwargs):
+    bump_version_on_commit('tags', 'recipes', 'recipe_fragments')
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def recipe_changed(instance, **kwargs):
+    bump_version_on_commit('recipes')
+    drop_recipe_fragments_on_commit([instance.pk])
+
+
+@receiver((post_save, post_delete), sender=IngredientRecipe)
+def recipe_ingredient_changed(instance, **kwargs):
+    bump_version_on_commit('recipes')
+    drop_recipe_fragments_on_commit([instance.recipe_id])
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    bump_version_on_commit('recipes')
+    if not reverse:
+        drop_recipe_fragments_on_commit([instance.pk])
+    elif pk_set:
+        drop_recipe_fragments_on_commit(pk_set)
+    else:
+        bump_version_on_commit('recipe_fragments')
+
+
+@receiver((post_save, post_delete), sender=User)
+def user_changed(update_fields=None, **kwargs):
+    if update_fields is None or USER_PUBLIC_FIELDS & set(update_fields):
+        bump_version_on_commit('recipes', 'recipe_fragments')
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_created(instance, created, **kwargs):
+    if created:
+        feed.fan_out([instance])
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(instance, created, **kwargs):
+    if created:
+        feed.backfill(instance.user, instance.author)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(instance, **kwargs):
+    feed.remove(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(instance, **kwargs):
+    publish_recipe_ingredients({instance.pk: []})
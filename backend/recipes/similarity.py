@@ -0,0 +1,83 @@
+from itertools import chain
+
+import numpy as np
+from scipy import sparse
+
+from .models import IngredientRecipe, RecipeNeighbour
+
+METRICS = ('cosine', 'jaccard')
+
+
+class IngredientMatrix:
+    """ Разреженная матрица рецепт × ингредиент из IngredientRecipe.
+        Ингредиенты, которые есть больше чем в max_share рецептов
+        (соль, вода), не порождают кандидатов, но входят в сходство. """
+
+    def __init__(self, max_share=0.5):
+        pairs = np.fromiter(chain.from_iterable(
+            IngredientRecipe.objects.order_by().values_list(
+                'recipe_id', 'ingredient_id'
+            ).iterator(chunk_size=10000)
+        ), dtype=np.int64).reshape(-1, 2)
+        self.recipe_ids, rows = np.unique(pairs[:, 0], return_inverse=True)
+        _, columns = np.unique(pairs[:, 1], return_inverse=True)
+        matrix = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, columns)),
+            shape=(len(self.recipe_ids), columns.max(initial=-1) + 1)
+        )
+        matrix.sum_duplicates()
+        matrix.data[:] = 1
+        self.sizes = np.asarray(matrix.sum(axis=1)).ravel()
+        shares = np.asarray(matrix.sum(axis=0)).ravel() / max(
+            len(self.recipe_ids), 1
+        )
+        rare = shares <= max_share
+        self.rare = matrix[:, rare].tocsr()
+        self.rare_transposed = self.rare.T.tocsr()
+        self.common = matrix[:, ~rare].toarray().astype(bool)
+
+    def get_rows(self, recipe_ids):
+        """ Номера строк матрицы для id рецептов с ингредиентами. """
+        recipe_ids = np.fromiter(set(recipe_ids), dtype=np.int64)
+        recipe_ids = recipe_ids[np.isin(recipe_ids, self.recipe_ids)]
+        return np.searchsorted(self.recipe_ids, np.sort(recipe_ids))
+
+    def neighbours(self, rows, top_k, metric='cosine'):
+        """ top_k соседей для строк rows одним матричным произведением:
+            массивы (recipe_id, similar_id, score). """
+        product = (self.rare[rows] @ self.rare_transposed).tocoo()
+        local, columns = product.row, product.col
+        sources = rows[local]
+        other = sources != columns
+        local, sources, columns = local[other], sources[other], columns[other]
+        overlap = product.data[other] + (
+            self.common[sources] & self.common[columns]
+        ).sum(axis=1)
+        if metric == 'jaccard':
+            scores = overlap / (
+                self.sizes[sources] + self.sizes[columns] - overlap
+            )
+        else:
+            scores = overlap / np.sqrt(
+                self.sizes[sources] * self.sizes[columns]
+            )
+        order = np.lexsort((columns, -scores, local))
+        local, columns, scores = local[order], columns[order], scores[order]
+        ranks = np.arange(len(local)) - np.searchsorted(local, local)
+        best = ranks < top_k
+        return (
+            self.recipe_ids[rows[local[best]]],
+            self.recipe_ids[columns[best]],
+            scores[best],
+        )
+
+
+def store_neighbours(recipe_ids, neighbours, batch_size=5000):
+    """ Заменить соседей рецептов свежими значениями. """
+    RecipeNeighbour.objects.filter(recipe_id__in=recipe_ids).delete()
+    RecipeNeighbour.objects.bulk_create((
+        RecipeNeighbour(recipe_id=recipe, similar_id=similar, score=score)
+        for recipe, similar, score in zip(*(
+            array.tolist() for array in neighbours
+        ))
+    ), batch_size=batch_size)
@@ -0,0 +1,325 @@
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock, skipUnless
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from users.models import User
+
+from .management.commands.check_query_budgets import BUDGETS, Command
+from .models import (Ingredient, IngredientRecipe, Recipe, ShoppingCart,
+                     ShoppingListItem, Tag)
+from .search import (RECIPE_INGREDIENTS_LOG, RecipeIngredientIndex,
+                     publish_recipe_ingredients, search_recipes)
+
+
+class AdminShoppingListTests(TestCase):
+    """ Правки рецептов и корзин в админке пересчитывают сводные
+        списки покупок. """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(
+            email='admin@foodgram.ru', username='admin', password='Pass-12345',
+            first_name='admin', last_name='admin',
+        )
+        cls.buyer = User.objects.create_user(
+            email='buyer@foodgram.ru', username='buyer', password='Pass-12345',
+            first_name='buyer', last_name='buyer',
+        )
+        cls.tag = Tag.objects.create(
+            name='Обед', color='#000000', slug='lunch'
+        )
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {number}', measurement_unit='г'
+            )
+            for number in range(3)
+        ]
+        cls.recipe = Recipe.objects.create(
+            author=cls.admin, name='Суп', text='Описание', cooking_time=10,
+            image='recipes/image/test.png',
+        )
+        cls.recipe.tags.set([cls.tag])
+        cls.rows = [
+            IngredientRecipe.objects.create(
+                recipe=cls.recipe, ingredient=ingredient, amount=10
+            )
+            for ingredient in cls.ingredients[:2]
+        ]
+        ShoppingCart.objects.create(user=cls.buyer, recipe=cls.recipe)
+        ShoppingListItem.objects.refresh([cls.buyer.pk])
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def get_totals(self):
+        return dict(ShoppingListItem.objects.filter(
+            user=self.buyer
+        ).values_list('ingredient', 'total_amount'))
+
+    def assert_no_drift(self):
+        call_command('rebuild_shopping_lists', '--verify', stdout=StringIO())
+
+    def test_inline_change(self):
+        prefix = 'ingredienttorecipe'
+        data = {
+            'author': self.admin.pk, 'name': 'Суп', 'text': 'Описание',
+            'cooking_time': 10, 'tags': [self.tag.pk],
+            f'{prefix}-TOTAL_FORMS': 3, f'{prefix}-INITIAL_FORMS': 2,
+            f'{prefix}-MIN_NUM_FORMS': 1, f'{prefix}-MAX_NUM_FORMS': 1000,
+            f'{prefix}-0-id': self.rows[0].pk,
+            f'{prefix}-0-recipe': self.recipe.pk,
+            f'{prefix}-0-ingredient': self.ingredients[0].pk,
+            f'{prefix}-0-amount': 25,
+            f'{prefix}-1-id': self.rows[1].pk,
+            f'{prefix}-1-recipe': self.recipe.pk,
+            f'{prefix}-1-ingredient': self.ingredients[1].pk,
+            f'{prefix}-1-amount': 10,
+            f'{prefix}-1-DELETE': 'on',
+            f'{prefix}-2-recipe': self.recipe.pk,
+            f'{prefix}-2-ingredient': self.ingredients[2].pk,
+            f'{prefix}-2-amount': 5,
+        }
+        response = self.client.post(
+            f'/admin/recipes/recipe/{self.recipe.pk}/change/', data
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.get_totals(), {
+            self.ingredients[0].pk: 25, self.ingredients[2].pk: 5,
+        })
+        self.assert_no_drift()
+
+    def test_recipe_delete(self):
+        response = self.client.post(
+            f'/admin/recipes/recipe/{self.recipe.pk}/delete/', {'post': 'yes'}
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.get_totals(), {})
+        self.assert_no_drift()
+
+    def test_shopping_cart_delete(self):
+        cart = ShoppingCart.objects.get(user=self.buyer)
+        response = self.client.post(
+            f'/admin/recipes/shoppingcart/{cart.pk}/delete/', {'post': 'yes'}
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.get_totals(), {})
+        self.assert_no_drift()
+
+
+class QueryBudgetTests(TestCase):
+    """ Бюджеты SQL-запросов check_query_budgets: не больше бюджета
+        на одном объекте и столько же на десяти. """
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        isolated = override_settings(
+            CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'query-budgets',
+            }},
+            MEDIA_ROOT=media,
+        )
+        isolated.enable()
+        self.addCleanup(isolated.disable)
+
+    def test_budgets(self):
+        command = Command()
+        single, errors = command.run(1)
+        self.assertEqual(errors, [])
+        for name, budget in BUDGETS.items():
+            with self.subTest(name):
+                self.assertLessEqual(single[name], budget)
+        _, errors = command.run(
+            10, lambda name: self.assertNumQueries(single[name])
+        )
+        self.assertEqual(errors, [])
+
+
+@override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'recipe-ingredient-index',
+}})
+class RecipeIngredientIndexTests(TestCase):
+    """ Ответы индекса ингредиентов совпадают с ответами ORM,
+        в том числе после правок из журнала и после пропуска в нём. """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email='cook@foodgram.ru', username='cook', password='Pass-12345',
+            first_name='cook', last_name='cook',
+        )
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Продукт {number}', measurement_unit='г'
+            ).pk
+            for number in range(5)
+        ]
+        for number, used in enumerate(((0, 1), (1, 2), (0, 1, 2), (3,))):
+            cls.create_recipe(f'Рецепт {number}', used)
+
+    @classmethod
+    def create_recipe(cls, name, used):
+        recipe = Recipe.objects.create(
+            author=cls.author, name=name, text='Описание', cooking_time=10,
+            image='recipes/image/test.png',
+        )
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(recipe=recipe, ingredient_id=cls.ingredients[i],
+                             amount=10)
+            for i in used
+        )
+        return recipe
+
+    def setUp(self):
+        cache.clear()
+        self.index = RecipeIngredientIndex()
+
+    def get_expected(self, include=(), exclude=(), any_match=False,
+                     max_missing=None):
+        sets = {}
+        for recipe, ingredient in IngredientRecipe.objects.values_list(
+            'recipe', 'ingredient'
+        ):
+            sets.setdefault(recipe, set()).add(ingredient)
+        include, exclude = set(include), set(exclude)
+        if not include:
+            return [pk for pk, used in sets.items() if used & exclude]
+        if max_missing is not None:
+            matched = [
+                pk for pk, used in sets.items()
+                if used & include and len(used - include) <= max_missing
+            ]
+        elif any_match:
+            matched = [pk for pk, used in sets.items() if used & include]
+        else:
+            matched = [pk for pk, used in sets.items() if used >= include]
+        return [pk for pk in matched if not sets[pk] & exclude]
+
+    def assert_matches_orm(self):
+        first, second, third, fourth, missing = self.ingredients
+        for query in (
+            {'include': [first]},
+            {'include': [first, second]},
+            {'include': [first, third], 'any_match': True},
+            {'include': [first, second], 'max_missing': 0},
+            {'include': [first, second], 'max_missing': 1},
+            {'include': [second], 'exclude': [third]},
+            {'exclude': [fourth]},
+            {'include': [missing]},
+        ):
+            with self.subTest(**query):
+                ids, _ = self.index.match(**query)
+                self.assertEqual(
+                    sorted(ids.tolist()), sorted(self.get_expected(**query))
+                )
+
+    def change_recipes(self):
+        """ Создать, изменить и удалить рецепты с публикацией в журнал. """
+        with self.captureOnCommitCallbacks(execute=True):
+            created = self.create_recipe('Новый', (1, 4))
+            publish_recipe_ingredients({created.pk: [
+                self.ingredients[1], self.ingredients[4]
+            ]})
+        edited = Recipe.objects.get(name='Рецепт 0')
+        with self.captureOnCommitCallbacks(execute=True):
+            edited.ingredienttorecipe.all().delete()
+            IngredientRecipe.objects.bulk_create(
+                IngredientRecipe(recipe=edited, ingredient_id=pk, amount=5)
+                for pk in self.ingredients[2:4]
+            )
+            publish_recipe_ingredients({edited.pk: self.ingredients[2:4]})
+        with self.captureOnCommitCallbacks(execute=True):
+            Recipe.objects.get(name='Рецепт 3').delete()
+        self.assertEqual(cache.get(RECIPE_INGREDIENTS_LOG), 3)
+
+    def test_match(self):
+        self.assertEqual(self.index.match(), (None, False))
+        self.assertTrue(self.index.match(exclude=[self.ingredients[0]])[1])
+        self.assert_matches_orm()
+
+    def test_log_applied_without_rebuild(self):
+        self.assert_matches_orm()
+        self.change_recipes()
+        with mock.patch.object(
+            self.index, '_build', wraps=self.index._build
+        ) as build:
+            self.assert_matches_orm()
+        build.assert_not_called()
+
+    def test_gap_in_log_rebuilds(self):
+        self.assert_matches_orm()
+        self.change_recipes()
+        cache.delete(f'{RECIPE_INGREDIENTS_LOG}:2')
+        with mock.patch(
+            'recipes.search.RECIPE_INGREDIENTS_GAP_TIMEOUT', 0
+        ), mock.patch.object(
+            self.index, '_build', wraps=self.index._build
+        ) as build:
+            self.assert_matches_orm()
+        build.assert_called_once()
+
+
+@skipUnless(
+    connection.vendor in ('sqlite', 'postgresql'), 'нужен FTS5 или tsvector'
+)
+class RecipeSearchTests(TestCase):
+    """ Полнотекстовый поиск по индексу, который ставит post_migrate:
+        совпадение в названии выше совпадения в описании, индекс
+        следит за правками и удалением рецептов. """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email='finder@foodgram.ru', username='finder',
+            password='Pass-12345', first_name='finder', last_name='finder',
+        )
+        cls.recipes = {
+            name: Recipe.objects.create(
+                author=cls.author, name=name, text=text, cooking_time=10,
+                image='recipes/image/test.png',
+            )
+            for name, text in (
+                ('Салат', 'Подавать к борщу или к супу, холодным'),
+                ('Борщ', 'Суп на говяжьем бульоне'),
+                ('Каша', 'Гречка на воде'),
+            )
+        }
+
+    def search(self, query):
+        return list(search_recipes(
+            Recipe.objects.all(), query
+        ).values_list('name', flat=True))
+
+    def test_name_outranks_text(self):
+        self.assertEqual(self.search('борщ'), ['Борщ', 'Салат'])
+        self.assertEqual(self.search('суп'), ['Борщ', 'Салат'])
+
+    def test_all_words_required(self):
+        self.assertEqual(self.search('суп холодным'), ['Салат'])
+        self.assertEqual(self.search('суп гречка'), [])
+
+    @skipUnless(connection.vendor == 'sqlite', 'префиксы только в FTS5')
+    def test_prefix_match(self):
+        self.assertEqual(self.search('греч'), ['Каша'])
+        self.assertEqual(self.search('"бор'), ['Борщ', 'Салат'])
+
+    def test_index_follows_changes(self):
+        porridge = self.recipes['Каша']
+        porridge.name = 'Овсянка'
+        porridge.text = 'Овсяные хлопья на молоке'
+        porridge.save(update_fields=['name', 'text'])
+        self.assertEqual(self.search('гречка'), [])
+        self.assertEqual(self.search('овсянка'), ['Овсянка'])
+        self.recipes['Борщ'].delete()
+        self.assertEqual(self.search('борщ'), ['Салат'])
+
+    def test_empty_query(self):
+        self.assertEqual(len(self.search('  ')), len(self.recipes))
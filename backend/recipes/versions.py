@@ -0,0 +1,48 @@
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+VERSION_KEY = 'version:{}'
+RECIPE_FRAGMENT_KEY = 'recipe:{}:{}'
+
+
+def get_version(name):
+    """ Текущая версия набора данных, создаётся при первом обращении. """
+    key = VERSION_KEY.format(name)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time(), None)
+        return cache.get(key)
+    return version
+
+
+def bump_version(name):
+    """ Сменить версию набора данных после изменения. """
+    version = time.time()
+    cache.set(VERSION_KEY.format(name), version, None)
+    return version
+
+
+def bump_version_on_commit(*names):
+    """ Сменить версии после фиксации транзакции, чтобы кеш
+        не заполнился данными, которые ещё не видны другим. """
+    def bump():
+        for name in names:
+            bump_version(name)
+    transaction.on_commit(bump)
+
+
+def get_recipe_fragment_key(pk, version=None):
+    """ Ключ общей для всех пользователей части представления рецепта. """
+    if version is None:
+        version = get_version('recipe_fragments')
+    return RECIPE_FRAGMENT_KEY.format(version, pk)
+
+
+def drop_recipe_fragments_on_commit(ids):
+    """ Удалить представления рецептов после фиксации транзакции. """
+    ids = list(ids)
+    transaction.on_commit(lambda: cache.delete_many(
+        [get_recipe_fragment_key(pk) for pk in ids]
+    ))
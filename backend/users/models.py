@@ -5,10 +5,29 @@ from django.db import models
 from django.db.models import F, Q, UniqueConstraint
 
 
-class User(AbstractUser):
+class DerivedFieldsMixin:
+    """ Поля derived_fields меняют запросы UPDATE ... F() и команды
+        пересчёта. save() сохранённого объекта без update_fields их
+        не пишет, иначе он вернул бы значения, прочитанные при загрузке. """
+    derived_fields = ()
+
+    def save(self, *args, **kwargs):
+        if (not args and not self._state.adding
+                and kwargs.get('update_fields') is None
+                and not kwargs.get('force_insert')):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.derived_fields
+            ]
+        super().save(*args, **kwargs)
+
+
+class User(DerivedFieldsMixin, AbstractUser):
     """ Модель пользователя. """
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ('username', 'first_name', 'last_name', )
+    derived_fields = ('recipes_count', 'followers_count')
     first_name = models.CharField(
         verbose_name='Имя',
         max_length=settings.LENGTH_OF_FIELDS_USER_1
@@ -28,6 +47,16 @@ class User(AbstractUser):
         unique=True,
         validators=(UnicodeUsernameValidator(), )
     )
+    recipes_count = models.PositiveIntegerField(
+        verbose_name='Рецептов',
+        default=0,
+        editable=False
+    )
+    followers_count = models.PositiveIntegerField(
+        verbose_name='Подписчиков',
+        default=0,
+        editable=False
+    )
 
     class Meta:
         ordering = ('username', )